@@ -0,0 +1,328 @@
+"""
+Benchmark harness for the entries and non-entries.
+
+Runs every engine over a matrix of file sizes, workload profiles and compressions
+(generated with create_measurements.py and kept in bench_data/), optionally pinned to
+several core counts, with warmup runs and repetitions, and records per run the wall time, user/sys CPU and peak RSS. Results are written to
+bench_results/<commit>.json; with --baseline, engines whose median got slower than the
+threshold are reported and the exit status is 1.
+
+    python benchmark.py --rows 1_000_000,10_000_000 --profiles uniform,zipf
+    python benchmark.py --baseline bench_results/baseline.json --threshold 0.1
+    python benchmark.py --engines entries/jelle.py --compressions none,gzip,bgzf
+    python benchmark.py --engines entries/jelle.py --engines "entries/jelle.py --threads" --cores 1,2,4
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+DATA_DIR = pathlib.Path("bench_data")
+RESULTS_DIR = pathlib.Path("bench_results")
+
+# File suffix of each --compress option of create_measurements.py
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "bgzf": ".bgz"}
+
+# Only these engines read compressed files; the others are skipped on them
+COMPRESSED_ENGINES = ("entries/jelle.py",)
+
+# Engines that take --workers; with --cores they get one worker per core
+WORKER_ENGINES = ("entries/jelle.py",)
+
+
+def discover_engines():
+    """
+    Every runnable file in entries/ and non_entries/ (helpers starting with an
+    underscore excluded), plus the optional backends whose dependencies are installed,
+    and jelle.py's worker threads if this interpreter runs without the GIL.
+    """
+    engines = [
+        str(path)
+        for directory in ("entries", "non_entries")
+        for path in sorted(pathlib.Path(directory).glob("*.py"))
+        if not path.name.startswith("_")
+    ]
+    if importlib.util.find_spec("numpy") is not None:
+        engines.append("entries/jelle.py --engine numpy")
+    if not getattr(sys, "_is_gil_enabled", lambda: True)():
+        engines.append("entries/jelle.py --threads")
+    return engines
+
+
+def fixture(rows, profile, seed, compression="none"):
+    """
+    Returns the path of the measurements file for one matrix cell, generating it on
+    first use. The seed is fixed, so every commit is measured on the same bytes, and
+    the compressed fixtures hold the same rows as the uncompressed one.
+    """
+    path = DATA_DIR / f"{profile}_{rows}_{seed}.txt{COMPRESSION_SUFFIXES[compression]}"
+    if not path.exists():
+        DATA_DIR.mkdir(exist_ok=True)
+        subprocess.run(
+            [sys.executable, "create_measurements.py", "--rows", str(rows), "--profile", profile,
+             "--seed", str(seed), "--output", str(path), "--compress", compression],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+    return path
+
+
+def drop_file_cache(path):
+    """
+    Evicts a file from the page cache with POSIX_FADV_DONTNEED, which needs no
+    privileges (unlike /proc/sys/vm/drop_caches) but only affects this file.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def warm_file_cache(path):
+    with open(path, "rb") as f:
+        while f.read(16 * 1024 * 1024):
+            pass
+
+
+def pin_to_cores(cores):
+    """
+    Returns a preexec_fn that restricts the child (and every process or thread it
+    starts) to the first `cores` CPUs this process may run on.
+    """
+    cpus = sorted(os.sched_getaffinity(0))[:cores]
+    return lambda: os.sched_setaffinity(0, cpus)
+
+
+def run_once(engine, path, timeout, cores=None):
+    """
+    Runs an engine on a file and returns its measurements and output digest. With
+    `cores`, the engine is pinned to that many CPUs and, if it takes --workers, runs
+    as many workers.
+
+    The child is reaped with os.wait4, whose rusage covers the child and every
+    worker it waited for: CPU time is their total, ru_maxrss the largest of them.
+    """
+    command = [sys.executable, *engine.split(), str(path)]
+    if cores is not None and engine.startswith(WORKER_ENGINES):
+        command += ["--workers", str(cores)]
+    with tempfile.TemporaryFile() as out:
+        tic = time.perf_counter()
+        proc = subprocess.Popen(
+            command,
+            stdout=out,
+            stderr=subprocess.DEVNULL,
+            preexec_fn=None if cores is None else pin_to_cores(cores),
+        )
+        deadline = tic + timeout
+        while True:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                break
+            if time.perf_counter() > deadline:
+                proc.kill()
+                os.wait4(proc.pid, 0)
+                raise TimeoutError(f"{engine} took longer than {timeout} seconds")
+            time.sleep(0.001)
+        toc = time.perf_counter()
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{engine} exited with status {proc.returncode}")
+        out.seek(0)
+        digest = hashlib.sha256(out.read()).hexdigest()
+    return {
+        "wall": toc - tic,
+        "user": rusage.ru_utime,
+        "sys": rusage.ru_stime,
+        "max_rss_kib": rusage.ru_maxrss,
+    }, digest
+
+
+def summarize(runs):
+    walls = [run["wall"] for run in runs]
+    return {
+        "median": statistics.median(walls),
+        "mean": statistics.fmean(walls),
+        "stdev": statistics.stdev(walls) if len(walls) > 1 else 0.0,
+        "min": min(walls),
+        "max": max(walls),
+        "cpu_median": statistics.median(run["user"] + run["sys"] for run in runs),
+        "max_rss_kib": max(run["max_rss_kib"] for run in runs),
+    }
+
+
+def benchmark(
+    engines, rows_list, profiles, repetitions, warmup, cache_mode, seed, timeout, compressions=("none",), cores_list=(None,)
+):
+    results = []
+    for rows in rows_list:
+        for profile in profiles:
+            digests = {}
+            for compression in compressions:
+                path = fixture(rows, profile, seed, compression)
+                for cores in cores_list:
+                    for engine in engines:
+                        if compression != "none" and not engine.startswith(COMPRESSED_ENGINES):
+                            continue
+                        pinned = "" if cores is None else f" on {cores} core(s)"
+                        print(f"{profile:>16} {rows:>13,} {compression:>5} {engine}{pinned}", end="", flush=True)
+                        result = {
+                            "engine": engine,
+                            "profile": profile,
+                            "rows": rows,
+                            "compression": compression,
+                            "cores": cores,
+                            "bytes": path.stat().st_size,
+                        }
+                        try:
+                            if cache_mode == "warm":
+                                warm_file_cache(path)
+                            for _ in range(warmup):
+                                run_once(engine, path, timeout, cores)
+                            runs = []
+                            for _ in range(repetitions):
+                                if cache_mode == "cold":
+                                    drop_file_cache(path)
+                                run, digest = run_once(engine, path, timeout, cores)
+                                runs.append(run)
+                                digests.setdefault(digest, []).append(engine)
+                                result["digest"] = digest
+                        except (RuntimeError, TimeoutError) as e:
+                            print(f"  FAILED: {e}")
+                            result["error"] = str(e)
+                        else:
+                            result["runs"] = runs
+                            result.update(summarize(runs))
+                            result["rows_per_second"] = rows / result["median"]
+                            print(
+                                f"  {result['median']:.3f}s ± {result['stdev']:.3f}  {result['rows_per_second'] / 1e6:.2f} Mrows/s"
+                                f"  cpu {result['cpu_median']:.2f}s  rss {result['max_rss_kib'] / 1024:.0f} MiB"
+                            )
+                        results.append(result)
+
+            # Engines must agree on the output, compressed or not; the digest most runs produced wins
+            if len(digests) > 1:
+                majority = max(digests, key=lambda digest: len(digests[digest]))
+                for result in results:
+                    if result["rows"] == rows and result["profile"] == profile and result.get("digest") not in (None, majority):
+                        result["error"] = "output differs from the other engines"
+                        print(f"  MISMATCH: {result['engine']} on {profile} {rows:,} ({result['compression']})")
+    return results
+
+
+def current_commit():
+    """
+    Short hash of HEAD, suffixed with -dirty when the worktree has changes.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Yields (result, baseline_median) for every matrix cell whose median wall time is
+    more than `threshold` (a fraction) above the baseline, and also beyond two
+    baseline standard deviations so noisy cells do not trip the gate.
+    """
+    def key(r):
+        return r["engine"], r["profile"], r["rows"], r.get("compression", "none"), r.get("cores")
+
+    previous = {key(r): r for r in baseline["results"] if "median" in r}
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or "median" not in result:
+            continue
+        limit = max(old["median"] * (1 + threshold), old["median"] + 2 * old["stdev"])
+        if result["median"] > limit:
+            yield result, old["median"]
+
+
+def parse_counts(text):
+    return [int(value) for value in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the entries over a matrix of file sizes and workloads.")
+    parser.add_argument("--engines", action="append", metavar="COMMAND", help="engine command line to run (repeatable, default: all of entries/ and non_entries/)")
+    parser.add_argument("--rows", type=parse_counts, default=[1_000_000], help="comma-separated file sizes in rows (default: 1_000_000)")
+    parser.add_argument("--profiles", default="uniform", help="comma-separated workload profiles of create_measurements.py (default: uniform)")
+    parser.add_argument("--compressions", default="none", help="comma-separated fixture compressions: none, gzip, bgzf (default: none); only jelle.py runs on compressed ones")
+    parser.add_argument("--cores", type=parse_counts, default=[None], help="comma-separated core counts to pin every run to, e.g. 1,2,4; jelle.py then runs one worker per core (default: unpinned)")
+    parser.add_argument("--repetitions", type=int, default=5, help="measured runs per engine and file (default: 5)")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured runs before the measured ones (default: 1)")
+    parser.add_argument("--cache", choices=("warm", "cold"), default="warm", help="read the file into the page cache first, or evict it before every run")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the generated files (default: 42)")
+    parser.add_argument("--timeout", type=float, default=3600, help="seconds before a run is killed (default: 3600)")
+    parser.add_argument("--baseline", metavar="JSON", help="results file to compare against; regressions make the exit status 1")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown of the median counted as a regression (default: 0.10)")
+    parser.add_argument("--save-baseline", action="store_true", help="also write the results to bench_results/baseline.json")
+    args = parser.parse_args()
+
+    engines = args.engines or discover_engines()
+    profiles = args.profiles.split(",")
+    compressions = args.compressions.split(",")
+    unknown = set(compressions) - set(COMPRESSION_SUFFIXES)
+    if unknown:
+        parser.error(f"unknown compression(s): {', '.join(sorted(unknown))}")
+    available = len(os.sched_getaffinity(0))
+    if any(cores is not None and not 1 <= cores <= available for cores in args.cores):
+        parser.error(f"--cores must be between 1 and the {available} CPU(s) available")
+    results = benchmark(
+        engines, args.rows, profiles, args.repetitions, args.warmup, args.cache, args.seed, args.timeout, compressions, args.cores
+    )
+
+    commit = current_commit()
+    report = {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {
+            "repetitions": args.repetitions,
+            "warmup": args.warmup,
+            "cache": args.cache,
+            "seed": args.seed,
+            "compressions": compressions,
+            "cores": args.cores,
+        },
+        "results": results,
+    }
+    RESULTS_DIR.mkdir(exist_ok=True)
+    output = RESULTS_DIR / f"{commit}.json"
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nresults written to {output}")
+    if args.save_baseline:
+        (RESULTS_DIR / "baseline.json").write_text(json.dumps(report, indent=2))
+
+    failed = [r for r in results if "error" in r]
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(pathlib.Path(args.baseline).read_text())
+        regressions = list(find_regressions(results, baseline, args.threshold))
+        print(f"\ncompared to {baseline['commit']}: {len(regressions)} regression(s)")
+        for result, old_median in regressions:
+            pinned = "" if result.get("cores") is None else f", {result['cores']} cores"
+            print(
+                f"  REGRESSION {result['engine']} on {result['profile']} {result['rows']:,} rows ({result['compression']}{pinned}): "
+                f"{old_median:.3f}s -> {result['median']:.3f}s (+{result['median'] / old_median - 1:.0%})"
+            )
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
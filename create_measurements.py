@@ -18,41 +18,53 @@
 
 # Based on https://github.com/gunnarmorling/1brc/blob/main/src/main/java/dev/morling/onebrc/CreateMeasurements.java
 
+import argparse
+import gzip
+import itertools
+import multiprocessing as mp
 import os
-import sys
 import random
+import shutil
+import struct
+import sys
 import time
+import zlib
+
+# Rows generated per block. Each block is generated from its own seed, so the output
+# only depends on --seed, never on the number of workers.
+BLOCK_ROWS = 1_000_000
+
+# Every temperature in [-99.9, 99.9] in tenths, preformatted with its newline
+TEMPERATURES = [f"{tenths / 10:.1f}\n".encode() for tenths in range(-999, 1000)]
+
+# BGZF members hold at most this much uncompressed data, so that even a member that
+# does not compress stays below the 64 KiB the format allows
+BGZF_BLOCK = 0xFF00
+# The empty member that ends a BGZF file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
 
+# Station names followed by ';' and their cumulative weights (None for uniform), set
+# in each worker by `init_worker`
+stations = []
+station_cum_weights = None
 
-def check_args(file_args):
+# The challenge allows at most 10,000 distinct stations of at most 100 bytes
+MAX_STATIONS = 10_000
+MAX_NAME_BYTES = 100
+
+
+def build_weather_station_name_list(file_name="weather_stations.csv"):
     """
-    Sanity checks out input and prints out usage if input is not a positive integer
+    Grabs the weather station names from example data provided in repo and dedups,
+    keeping file order so a seed always picks the same stations
     """
-    try:
-        if len(file_args) != 2 or int(file_args[1]) <= 0:
-            raise Exception()
-    except:
-        print(
-            "Usage:  create_measurements.sh <positive integer number of records to create>"
-        )
-        print("        You can use underscore notation for large number of records.")
-        print("        For example:  1_000_000_000 for one billion")
-        exit()
-
-
-def build_weather_station_name_list():
-    """
-    Grabs the weather station names from example data provided in repo and dedups
-    """
-    station_names = []
-    with open("weather_stations.csv", "r") as file:
-        file_contents = file.read()
-    for station in file_contents.splitlines():
-        if "#" in station:
-            next
-        else:
-            station_names.append(station.split(";")[0])
-    return list(set(station_names))
+    station_names = {}
+    with open(file_name, "r", encoding="utf-8") as file:
+        for station in file.read().splitlines():
+            if station.startswith("#"):
+                continue
+            station_names[station.split(";")[0]] = None
+    return list(station_names)
 
 
 def convert_bytes(num):
@@ -83,12 +95,13 @@ def format_elapsed_time(seconds):
             return f"{int(hours)} hours {int(minutes)} minutes {int(seconds)} seconds"
 
 
-def estimate_file_size(weather_station_names, num_rows_to_create):
+def estimate_file_size(weather_station_names, num_rows_to_create, weights=None):
     """
     Tries to estimate how large a file the test data will be
     """
-    total_name_bytes = sum(len(s.encode("utf-8")) for s in weather_station_names)
-    avg_name_bytes = total_name_bytes / float(len(weather_station_names))
+    weights = weights or [1] * len(weather_station_names)
+    total_name_bytes = sum(len(s.encode("utf-8")) * w for s, w in zip(weather_station_names, weights))
+    avg_name_bytes = total_name_bytes / float(sum(weights))
 
     # avg_temp_bytes = sum(len(str(n / 10.0)) for n in range(-999, 1000)) / 1999
     avg_temp_bytes = 4.400200100050025
@@ -101,66 +114,263 @@ def estimate_file_size(weather_station_names, num_rows_to_create):
     return f"Estimated max file size is:  {human_file_size}."
 
 
-def build_test_data(weather_station_names, num_rows_to_create):
+def pad_name(name, size, filler):
+    """
+    Pads a station name with a multi-byte character to exactly `size` UTF-8 bytes,
+    topping up with ASCII where the filler no longer fits
+    """
+    name = f"{name} "
+    while len((name + filler).encode()) <= size:
+        name += filler
+    return name + "x" * (size - len(name.encode()))
+
+
+def uniform_profile(names, count, rng, exponent):
+    """
+    `count` stations, every one equally frequent
+    """
+    return rng.sample(names, min(count, len(names))), None
+
+
+def zipf_profile(names, count, rng, exponent):
+    """
+    `count` stations whose frequencies follow Zipf's law: the k-th most frequent one
+    occurs proportionally to 1 / k**exponent
+    """
+    names = rng.sample(names, min(count, len(names)))
+    return names, [1 / rank**exponent for rank in range(1, len(names) + 1)]
+
+
+def max_cardinality_profile(names, count, rng, exponent):
+    """
+    All 10,000 stations the rules allow, equally frequent
+    """
+    return uniform_profile(names, MAX_STATIONS, rng, exponent)
+
+
+def long_names_profile(names, count, rng, exponent):
+    """
+    `count` stations with names of exactly 100 bytes, padded with 2, 3 and 4 byte
+    UTF-8 characters
+    """
+    names, _ = uniform_profile(names, count, rng, exponent)
+    fillers = itertools.cycle(["é", "€", "𝄞"])
+    return list(dict.fromkeys(pad_name(name, MAX_NAME_BYTES, filler) for name, filler in zip(names, fillers))), None
+
+
+def collision_heavy_profile(names, count, rng, exponent):
+    """
+    `count` stations with names of the same length that only differ in their last
+    few bytes, so hashes of a name's length and first bytes all collide
+    """
+    count = min(count, MAX_STATIONS)
+    digits = len(str(count - 1))
+    prefix = pad_name("Collision", MAX_NAME_BYTES - digits, "-")
+    return [f"{prefix}{station:0{digits}d}" for station in range(count)], None
+
+
+def few_stations_profile(names, count, rng, exponent):
     """
-    Generates and writes to file the requested length of test data
+    A handful of stations, so every row updates the same few entries
+    """
+    return uniform_profile(names, min(count, 8), rng, exponent)
+
+
+# Named workloads selectable with --profile: each returns the station names to draw
+# rows from and their relative weights (None for uniform)
+PROFILES = {
+    "uniform": uniform_profile,
+    "zipf": zipf_profile,
+    "max-cardinality": max_cardinality_profile,
+    "long-names": long_names_profile,
+    "collision-heavy": collision_heavy_profile,
+    "few-stations": few_stations_profile,
+}
+
+
+def bgzf_compress(data):
+    """
+    Compresses data into BGZF members: gzip members of at most 64 KiB that record
+    their own size in a "BC" extra field, so a reader can find every member without
+    decompressing, and decompress them in parallel
+    """
+    members = []
+    for start in range(0, len(data), BGZF_BLOCK):
+        block = data[start:start + BGZF_BLOCK]
+        for level in (6, 0):
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            deflated = compressor.compress(block) + compressor.flush()
+            if len(deflated) + 26 <= 65536:
+                break
+        # Header with FEXTRA, the BC subfield holding the member size minus one
+        header = struct.pack("<4sIBBHBBHH", b"\x1f\x8b\x08\x04", 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25)
+        members += [header, deflated, struct.pack("<II", zlib.crc32(block), len(block))]
+    return b"".join(members)
+
+
+# Output compressions selectable with --compress: each turns a block of rows into
+# its compressed bytes, which can be concatenated
+COMPRESSIONS = {
+    "none": None,
+    "gzip": gzip.compress,
+    "bgzf": bgzf_compress,
+}
+
+
+def block_seed(seed, block):
+    """
+    Derives the seed of one block from the run seed
+    """
+    return f"{seed}:{block}"
+
+
+def init_worker(station_prefixes, cum_weights):
+    global stations, station_cum_weights
+    stations = station_prefixes
+    station_cum_weights = cum_weights
+
+
+def generate_block(task):
+    """
+    Generates one block of rows into its own shard file and returns the shard's path.
+
+    Rows are built in bulk: stations and temperatures are drawn as whole lists of
+    preencoded bytes and interleaved with a single join, so no row is formatted.
+    """
+    block, rows, seed, shard, compression = task
+    rng = random.Random(block_seed(seed, block))
+    parts = [b""] * (2 * rows)
+    parts[0::2] = rng.choices(stations, cum_weights=station_cum_weights, k=rows)
+    parts[1::2] = rng.choices(TEMPERATURES, k=rows)
+    data = b"".join(parts)
+    if COMPRESSIONS[compression] is not None:
+        data = COMPRESSIONS[compression](data)
+    with open(shard, "wb") as file:
+        file.write(data)
+    return shard
+
+
+def append_file(destination, source_path):
+    """
+    Appends a shard to the output, in the kernel where os.copy_file_range is available
+    """
+    with open(source_path, "rb") as source:
+        if hasattr(os, "copy_file_range"):
+            remaining = os.fstat(source.fileno()).st_size
+            while remaining:
+                copied = os.copy_file_range(source.fileno(), destination.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+            if not remaining:
+                return
+            source.seek(-remaining, os.SEEK_END)
+        shutil.copyfileobj(source, destination)
+
+
+def build_test_data(
+    weather_station_names,
+    num_rows_to_create,
+    output="measurements.txt",
+    seed=None,
+    workers=None,
+    weights=None,
+    compression="none",
+):
+    """
+    Generates and writes to file the requested length of test data.
+
+    The rows are split into blocks of BLOCK_ROWS that a pool of processes generates
+    (and compresses, if asked to) into shard files next to the output; the shards are
+    appended to the output in block order as they complete. Both gzip and BGZF allow
+    concatenating compressed blocks: a gzip output has one member per block.
     """
     start_time = time.time()
-    coldest_temp = -99.9
-    hottest_temp = 99.9
-    station_names_10k_max = random.choices(weather_station_names, k=10_000)
-    batch_size = 10000  # instead of writing line by line to file, process a batch of stations and put it to disk
-    chunks = num_rows_to_create // batch_size
+    station_prefixes = [f"{station};".encode() for station in weather_station_names]
+    cum_weights = list(itertools.accumulate(weights)) if weights else None
+    blocks = -(-num_rows_to_create // BLOCK_ROWS)
+    tasks = [
+        (block, min(BLOCK_ROWS, num_rows_to_create - block * BLOCK_ROWS), seed, f"{output}.part{block:06d}", compression)
+        for block in range(blocks)
+    ]
     print("Building test data...")
 
     try:
-        with open("measurements.txt", "w") as file:
+        with open(output, "wb") as file, mp.Pool(workers, init_worker, (station_prefixes, cum_weights)) as pool:
             progress = 0
-            for chunk in range(chunks):
-                batch = random.choices(station_names_10k_max, k=batch_size)
-                prepped_deviated_batch = "\n".join(
-                    [
-                        f"{station};{random.uniform(coldest_temp, hottest_temp):.1f}"
-                        for station in batch
-                    ]
-                )  # :.1f should quicker than round on a large scale, because round utilizes mathematical operation
-                file.write(prepped_deviated_batch + "\n")
+            for done, shard in enumerate(pool.imap(generate_block, tasks), 1):
+                file.flush()
+                append_file(file, shard)
+                os.unlink(shard)
 
                 # Update progress bar every 1%
-                if (chunk + 1) * 100 // chunks != progress:
-                    progress = (chunk + 1) * 100 // chunks
+                if done * 100 // blocks != progress:
+                    progress = done * 100 // blocks
                     bars = "=" * (progress // 2)
                     sys.stdout.write(f"\r[{bars:<50}] {progress}%")
                     sys.stdout.flush()
+            if compression == "bgzf":
+                file.write(BGZF_EOF)
         sys.stdout.write("\n")
     except Exception as e:
         print("Something went wrong. Printing error info and exiting...")
         print(e)
-        exit()
+        for _, _, _, shard, _ in tasks:
+            if os.path.exists(shard):
+                os.unlink(shard)
+        exit(1)
 
     end_time = time.time()
     elapsed_time = end_time - start_time
-    file_size = os.path.getsize("measurements.txt")
+    file_size = os.path.getsize(output)
     human_file_size = convert_bytes(file_size)
 
-    print("Test data successfully written to 1brc/data/measurements.txt")
+    print(f"Test data successfully written to {output}")
     print(f"Actual file size:  {human_file_size}")
     print(f"Elapsed time: {format_elapsed_time(elapsed_time)}")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create a measurements file for the One Billion Row Challenge.")
+    parser.add_argument("num_rows", nargs="?", help="number of rows, e.g. 1_000_000_000 for one billion (same as --rows)")
+    parser.add_argument("--rows", help="number of rows to create; underscores are allowed")
+    parser.add_argument("--output", default="measurements.txt", help="file to write (default: measurements.txt)")
+    parser.add_argument("--profile", choices=PROFILES, default="uniform", help="workload profile (default: uniform)")
+    parser.add_argument("--stations", type=int, default=MAX_STATIONS, help="number of distinct stations to draw rows from (default: 10,000)")
+    parser.add_argument("--zipf-exponent", type=float, default=1.0, help="skew of the zipf profile (default: 1.0)")
+    parser.add_argument("--stations-file", default="weather_stations.csv", help="station names to sample from")
+    parser.add_argument("--seed", type=int, default=None, help="seed for a reproducible file (default: random, and printed)")
+    parser.add_argument("--compress", choices=COMPRESSIONS, default="none", help="compress the output: gzip (one member per million rows) or bgzf (64 KiB members that can be read in parallel)")
+    parser.add_argument("--workers", type=int, default=None, help="number of generator processes (default: CPU count)")
+    args = parser.parse_args()
+
+    rows = args.rows or args.num_rows
+    try:
+        if rows is None or int(rows) <= 0:
+            raise ValueError
+    except ValueError:
+        parser.error("the number of rows must be a positive integer, e.g. --rows 1_000_000_000")
+    args.rows = int(rows)
+    if args.stations <= 0:
+        parser.error("--stations must be positive")
+    return args
+
+
 def main():
     """
     main program function
     """
-    check_args(sys.argv)
-    num_rows_to_create = int(sys.argv[1])
-    weather_station_names = []
-    weather_station_names = build_weather_station_name_list()
-    print(estimate_file_size(weather_station_names, num_rows_to_create))
-    build_test_data(weather_station_names, num_rows_to_create)
+    args = parse_args()
+    seed = args.seed if args.seed is not None else random.SystemRandom().randrange(2**32)
+    print(f"Seed: {seed}")
+    weather_station_names = build_weather_station_name_list(args.stations_file)
+    rng = random.Random(seed)
+    weather_station_names, weights = PROFILES[args.profile](weather_station_names, args.stations, rng, args.zipf_exponent)
+    print(f"Profile: {args.profile} with {len(weather_station_names)} stations")
+    print(estimate_file_size(weather_station_names, args.rows, weights))
+    build_test_data(weather_station_names, args.rows, args.output, seed, args.workers, weights, args.compress)
     print("Test data build complete.")
 
 
 if __name__ == "__main__":
     main()
-exit()
@@ -0,0 +1,180 @@
+"""
+Binary columnar cache of a measurements file for jelle.py (`--build-cache`).
+
+The text is parsed once into a `FILE.cache` sidecar. Runs that find a cache which is
+still valid aggregate from its columns and do no text parsing at all.
+
+Layout (native byte order, every section 8-byte aligned):
+    header   magic, source size, source mtime_ns, rows, names_len
+    ids      uint16 station id per row (at most 10,000 stations)
+    temps    int16 temperature per row, in tenths
+    names    b"\\n"-joined station dictionary; a name's position is its id
+
+The cache stores the size and mtime of the file it was built from. If the file has
+changed since, the cache is ignored.
+"""
+import mmap
+import os
+import shutil
+import struct
+import sys
+from array import array
+
+from _chunker import iter_windows
+from _scan import TENTHS, WINDOW_SIZE, open_mapping
+
+MAGIC = b"1brccol1"
+HEADER = struct.Struct("=8sqqqq")
+# Bytes per row in the cache: a uint16 id and an int16 temperature
+ROW_BYTES = 4
+MAX_IDS = 1 << 16
+
+# The cache the workers aggregate from, opened by the parent before it forks (or by
+# each worker with `reopen_cache`).
+columns = None
+
+
+def cache_path(file_name):
+    return f"{file_name}.cache"
+
+
+def aligned(offset):
+    return -(-offset // 8) * 8
+
+
+class ColumnCache:
+    """
+    Read-only mapping of a cache file, exposing the `ids` and `temps` columns as
+    zero-copy memoryviews and the station dictionary as `names`.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
+        magic, self.source_size, self.source_mtime_ns, self.rows, names_len = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a measurements cache")
+        ids_offset = aligned(HEADER.size)
+        temps_offset = aligned(ids_offset + 2 * self.rows)
+        names_offset = aligned(temps_offset + 2 * self.rows)
+        view = memoryview(self.mm)
+        self.ids = view[ids_offset:ids_offset + 2 * self.rows].cast("H")
+        self.temps = view[temps_offset:temps_offset + 2 * self.rows].cast("h")
+        names = self.mm[names_offset:names_offset + names_len]
+        self.names = names.split(b"\n") if names else []
+
+    def row_chunks(self, rows_per_chunk):
+        """
+        Returns (start_row, end_row) ranges covering all rows.
+        """
+        return [(start, min(start + rows_per_chunk, self.rows)) for start in range(0, self.rows, rows_per_chunk)]
+
+
+def open_cache(file_name):
+    """
+    Returns the ColumnCache for `file_name` if one exists and still matches the
+    file's size and mtime, otherwise None.
+    """
+    path = cache_path(file_name)
+    if not os.path.exists(path):
+        return None
+    cache = ColumnCache(path)
+    stat = os.stat(file_name)
+    if (cache.source_size, cache.source_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        print(f"cache {path} is out of date, parsing {file_name}", file=sys.stderr)
+        return None
+    return cache
+
+
+def build_cache(file_name, window_size=WINDOW_SIZE):
+    """
+    Parses `file_name` once and writes its cache atomically. Returns the number of rows.
+
+    The text is read window by window like a jelle.py worker does, so memory stays
+    bounded. The ids column goes straight into the cache file and the temperature
+    column into a scratch file that is appended once the row count is known.
+    """
+    stat = os.stat(file_name)
+    path = cache_path(file_name)
+    tenths = TENTHS
+    ids = {}
+    rows = 0
+
+    mapping = open_mapping(file_name)
+    with open(f"{path}.tmp", "wb") as out, open(f"{path}.temps", "wb+") as temps_out:
+        out.write(bytes(aligned(HEADER.size)))
+        for window_start, window_end in iter_windows(mapping, 0, len(mapping), window_size):
+            id_column = array("H")
+            temp_column = array("h")
+            for line in mapping[window_start:window_end].splitlines():
+                city, measurement = line.split(b";")
+                station = ids.get(city)
+                if station is None:
+                    station = ids[city] = len(ids)
+                    if station >= MAX_IDS:
+                        raise ValueError(f"{file_name} has more than {MAX_IDS} stations")
+                id_column.append(station)
+                temp_column.append(tenths[measurement])
+            id_column.tofile(out)
+            temp_column.tofile(temps_out)
+            rows += len(id_column)
+
+        out.write(bytes(aligned(out.tell()) - out.tell()))
+        temps_out.seek(0)
+        shutil.copyfileobj(temps_out, out)
+        out.write(bytes(aligned(out.tell()) - out.tell()))
+        names = b"\n".join(ids)
+        out.write(names)
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, rows, len(names)))
+    os.unlink(f"{path}.temps")
+    os.replace(f"{path}.tmp", path)
+    return rows
+
+
+def reopen_cache(file_name):
+    """
+    Opens the cache of `file_name` as `columns` in a worker that was not forked from
+    the parent, which already checked that the cache is up to date.
+    """
+    global columns
+    columns = ColumnCache(cache_path(file_name))
+
+
+def process_rows(start, end, table, column_processor):
+    """
+    Aggregates rows [start, end) of the open cache into a StationTable preloaded
+    with the cache's station dictionary, so cache ids are table ids and no name is
+    ever looked up. The two column slices are handed to `column_processor`, see
+    `_scan.load_engine`.
+    """
+    column_processor(columns.ids[start:end], columns.temps[start:end], table)
+
+
+def process_columns(ids, temps, table, row_filter=None):
+    """
+    Aggregates a station-id column and a tenths column into `table`, whose ids are
+    the column's ids. With a RowFilter, only rows that pass it are aggregated; the
+    name test is done once per station, not per row.
+    """
+    mins, maxs, sums, counts = table.mins, table.maxs, table.sums, table.counts
+    if row_filter is None:
+        for station, measurement in zip(ids, temps):
+            if measurement < mins[station]:
+                mins[station] = measurement
+            if measurement > maxs[station]:
+                maxs[station] = measurement
+            sums[station] += measurement
+            counts[station] += 1
+        return
+
+    accepted = [row_filter.accepts_name(name) for name in table.names]
+    low, high = row_filter.min_tenths, row_filter.max_tenths
+    for station, measurement in zip(ids, temps):
+        if accepted[station] and low <= measurement <= high:
+            if measurement < mins[station]:
+                mins[station] = measurement
+            if measurement > maxs[station]:
+                maxs[station] = measurement
+            sums[station] += measurement
+            counts[station] += 1
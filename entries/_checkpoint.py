@@ -0,0 +1,84 @@
+"""
+Checkpoints for incremental aggregation of append-only files (`jelle.py --incremental`).
+
+A checkpoint is a JSON sidecar next to the measurements file holding the merged
+[min, max, sum, count] table, the byte offset up to which the file has been
+processed, and a CRC32 of the bytes just before that offset. On the next run only
+the bytes appended since are processed and merged into the saved table. If the file
+shrank or the bytes before the offset changed (truncation, rotation, rewrite), the
+checkpoint is ignored and the file is processed from the start.
+"""
+import json
+import os
+import sys
+import zlib
+
+CHECKPOINT_VERSION = 1
+# Number of bytes before the processed offset that must be unchanged.
+TAIL_BYTES = 4096
+
+
+def checkpoint_path(file_name):
+    return f"{file_name}.ckpt"
+
+
+def tail_checksum(mapping, offset):
+    """
+    Returns the CRC32 of the TAIL_BYTES bytes of `mapping` ending at `offset`.
+    """
+    return zlib.crc32(mapping[max(0, offset - TAIL_BYTES):offset])
+
+
+def load_checkpoint(file_name, mapping):
+    """
+    Returns (offset, names, columns) saved for `file_name`, where columns are the
+    mins, maxs, sums and counts lists, or None if there is no usable checkpoint.
+    `mapping` is the current contents of the file.
+    """
+    path = checkpoint_path(file_name)
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    offset = checkpoint["offset"]
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        reason = "was written by another version"
+    elif offset > len(mapping):
+        reason = "is past the end of the file"
+    elif tail_checksum(mapping, offset) != checkpoint["tail_crc32"]:
+        reason = "does not match the file contents"
+    else:
+        names = [name.encode() for name in checkpoint["names"]]
+        return offset, names, [checkpoint["mins"], checkpoint["maxs"], checkpoint["sums"], checkpoint["counts"]]
+
+    print(f"checkpoint {path} {reason}, processing from the start", file=sys.stderr)
+    return None
+
+
+def save_checkpoint(file_name, mapping, offset, table):
+    """
+    Atomically writes the checkpoint for `table`, which covers `mapping[:offset]`.
+    """
+    names, mins, maxs, sums, counts = [], [], [], [], []
+    for name, (m_min, m_max, m_sum, m_count) in table.items():
+        names.append(name.decode())
+        mins.append(m_min)
+        maxs.append(m_max)
+        sums.append(m_sum)
+        counts.append(m_count)
+    checkpoint = {
+        "version": CHECKPOINT_VERSION,
+        "offset": offset,
+        "tail_crc32": tail_checksum(mapping, offset),
+        "names": names,
+        "mins": mins,
+        "maxs": maxs,
+        "sums": sums,
+        "counts": counts,
+    }
+    path = checkpoint_path(file_name)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,113 @@
+"""
+Newline-aligned chunking of a memory-mapped file, shared by the entries.
+
+Boundaries are found with `mapping.find(b"\\n", ...)`, a C-level scan, instead of
+stepping one byte slice at a time. Two flavours:
+
+- `split_range` aligns every chunk up front, which costs one short `find` per chunk.
+- `LazyChunks` only does arithmetic up front: chunk i is the nominal byte range
+  [start + i * chunk_size, start + (i + 1) * chunk_size), and is aligned to whole lines
+  by whoever indexes it, i.e. by the worker that claims it. Startup cost is then
+  independent of the chunk count and the line length.
+
+Both follow the same convention: a line belongs to the chunk its first byte falls in,
+and a chunk's end points at the newline that terminates its last line (or at the end
+of the range), so adjacent chunks never share or drop a line.
+"""
+
+
+def split_range(mapping, start, end, chunk_size):
+    """
+    Splits the line-aligned byte range [start, end) of `mapping` into chunks of
+    roughly `chunk_size` bytes, each ending on a line boundary.
+
+    Returns:
+        List of (start, end) byte offsets, in file order.
+    """
+    chunks = []
+    find = mapping.find
+    while start < end:
+        stop = start + chunk_size
+        if stop >= end:
+            stop = end
+        else:
+            # Adjust 'stop' to the next newline to avoid splitting a line
+            stop = find(b"\n", stop, end)
+            if stop == -1:
+                stop = end
+        chunks.append((start, stop))
+        start = stop + 1
+    return chunks
+
+
+def iter_windows(mapping, start, end, window_size):
+    """
+    Yields (window_start, window_end) ranges covering [start, end) of `mapping`, a
+    chunk from `split_range` or `align_range`, or any buffer with find/rfind.
+
+    Each window is at most `window_size` bytes and ends on a newline, so lines are never
+    split across windows. A single line longer than the window becomes its own window.
+    """
+    pos = start
+    while pos < end:
+        stop = pos + window_size
+        if stop >= end:
+            stop = end
+        else:
+            newline = mapping.rfind(b"\n", pos, stop)
+            if newline == -1:
+                newline = mapping.find(b"\n", stop, end)
+            stop = end if newline == -1 else newline
+        yield pos, stop
+        pos = stop + 1
+
+
+def align_range(mapping, start, end):
+    """
+    Aligns an arbitrary byte range of `mapping` to whole lines.
+
+    A line belongs to the range if its first byte lies in [start, end). The returned
+    end points at the newline that terminates the last line, like the chunks from
+    `split_range`. The range is empty if no line starts in it.
+    """
+    size = len(mapping)
+    if start > 0:
+        start = mapping.find(b"\n", start - 1, size) + 1 or size
+    if end >= size:
+        end = size
+    elif end > 0:
+        newline = mapping.find(b"\n", end - 1, size)
+        end = size if newline == -1 else newline
+    return start, max(start, end)
+
+
+class LazyChunks:
+    """
+    The chunks of [start, end) of `mapping` as a sequence whose items are aligned on
+    access, see the module docstring. Meant to be created before forking, so every
+    worker indexes the same mapping. A mapping cannot be pickled, so a pickled copy
+    (for a spawned worker) comes without one; the worker sets `mapping` to its own
+    mapping of the same file.
+    """
+
+    def __init__(self, mapping, start, end, chunk_size):
+        self.mapping = mapping
+        self.start = start
+        self.end = end
+        self.chunk_size = chunk_size
+
+    def __getstate__(self):
+        return dict(self.__dict__, mapping=None)
+
+    def __len__(self):
+        return -(-(self.end - self.start) // self.chunk_size)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        nominal_start = self.start + index * self.chunk_size
+        nominal_end = min(nominal_start + self.chunk_size, self.end)
+        start, end = align_range(self.mapping, nominal_start, nominal_end)
+        # Never run past the end of the range, which may stop short of the file's end
+        end = min(end, self.end)
+        return start, max(start, end)
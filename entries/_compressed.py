@@ -0,0 +1,202 @@
+"""
+Gzip-compressed input for jelle.py, read without decompressing to disk first.
+
+A BGZF file (`bgzip`, or `create_measurements.py --compress bgzf`) is a series of
+independent gzip members of at most 64 KiB, each recording its own compressed size
+in a "BC" extra field. Walking those headers finds every member without inflating
+anything. Consecutive members are grouped into tasks of about `chunk_size`
+compressed bytes, and the workers decompress and parse their groups in parallel.
+
+Any other gzip file (one stream, or members without sizes) can only be inflated
+front to back. The parent then decompresses pieces of `chunk_size` bytes and hands
+them to the workers for parsing, with a bounded number in flight.
+
+Either way, a decompressed buffer starts and ends mid-line. A task parses the whole
+lines inside its buffer and returns the partial first and last line. The parent
+stitches those in file order and parses them itself.
+
+zstd is not in the standard library of the Python versions this supports, so only
+gzip is read here.
+"""
+import gzip
+import multiprocessing as mp
+import struct
+import zlib
+from collections import deque
+
+import _server
+from _output import write_results
+from _scan import CHUNK_SIZE, WINDOW_SIZE, load_engine, process_chunk
+from _stations import StationTable, load_station_names
+
+GZIP_MAGIC = b"\x1f\x8b"
+# ID1 ID2 CM FLG MTIME XFL OS XLEN
+GZIP_HEADER = struct.Struct("<4sIBBH")
+FEXTRA = 4
+
+
+def is_gzip(file_name):
+    with open(file_name, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def bgzf_blocks(mapping, start=0, end=None):
+    """
+    Returns (start, end, deflate_start) for every member of a BGZF file between the
+    byte offsets `start` and `end`, where the raw deflate data of a member starts at
+    `deflate_start` and ends 8 bytes (CRC32 and size) before the member. Returns None
+    if any member lacks the "BC" extra field that gives its size.
+    """
+    blocks = []
+    pos, end = start, len(mapping) if end is None else end
+    while pos < end:
+        if end - pos < GZIP_HEADER.size + 2:
+            return None
+        magic, _, _, _, xlen = GZIP_HEADER.unpack_from(mapping, pos)
+        if magic[:3] != b"\x1f\x8b\x08" or not magic[3] & FEXTRA:
+            return None
+        # Subfields: SI1 SI2 SLEN data
+        field, extra_end = pos + GZIP_HEADER.size, pos + GZIP_HEADER.size + xlen
+        block_size = None
+        while field + 4 <= extra_end:
+            si, slen = mapping[field:field + 2], struct.unpack_from("<H", mapping, field + 2)[0]
+            if si == b"BC" and slen == 2:
+                block_size = struct.unpack_from("<H", mapping, field + 4)[0] + 1
+            field += 4 + slen
+        if block_size is None:
+            return None
+        blocks.append((pos, pos + block_size, extra_end))
+        pos += block_size
+    return blocks
+
+
+def group_blocks(blocks, chunk_size):
+    """
+    Joins consecutive members into (start, end) ranges of about `chunk_size` bytes.
+    """
+    groups = []
+    for start, end, _ in blocks:
+        if groups and end - groups[-1][0] <= chunk_size:
+            groups[-1] = (groups[-1][0], end)
+        else:
+            groups.append((start, end))
+    return groups
+
+
+def aggregate_buffer(data, window_size, engine):
+    """
+    Aggregates the whole lines of a decompressed buffer into a fresh StationTable.
+    Runs in a pool worker.
+
+    Returns:
+        (table, head, tail): the bytes before the first newline and after the last
+        one. `tail` is None if the buffer has no newline at all.
+    """
+    table = StationTable(_server.station_names)
+    first = data.find(b"\n")
+    if first == -1:
+        return table, data, None
+    last = data.rfind(b"\n")
+    # Bytes support find/rfind and slicing, so the window walk works on them too
+    process_chunk(data, first + 1, last, table, window_size, load_engine(engine))
+    return table, data[:first], data[last + 1:]
+
+
+def decompress_task(task):
+    """
+    Inflates a group of BGZF members and aggregates it. Runs in a pool worker.
+
+    Members are inflated one by one from their known offsets, which (unlike
+    `gzip.decompress`) never copies the rest of the group.
+    """
+    path, start, end, window_size, engine = task
+    mapping = _server.mapped_file(path)
+    members = []
+    for block_start, block_end, deflate_start in bgzf_blocks(mapping, start, end):
+        member = zlib.decompress(mapping[deflate_start:block_end - 8], -zlib.MAX_WBITS)
+        if zlib.crc32(member) != struct.unpack_from("<I", mapping, block_end - 8)[0]:
+            raise ValueError(f"{path}: CRC mismatch in the member at byte {block_start}")
+        members.append(member)
+    return aggregate_buffer(b"".join(members), window_size, engine)
+
+
+def buffer_task(task):
+    data, window_size, engine = task
+    return aggregate_buffer(data, window_size, engine)
+
+
+def stream_pieces(file_name, piece_size):
+    """
+    Yields the decompressed contents of any gzip file in pieces of `piece_size`.
+    """
+    with gzip.open(file_name, "rb") as f:
+        while piece := f.read(piece_size):
+            yield piece
+
+
+def ordered_results(pool, function, tasks, in_flight):
+    """
+    Yields `function(task)` for every task, computed on the pool, in task order, with
+    at most `in_flight` tasks submitted but not yet consumed.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= in_flight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def aggregate_compressed(
+    pool, file_name, workers, chunk_size=CHUNK_SIZE, window_size=WINDOW_SIZE, engine="python"
+):
+    """
+    Aggregates a gzip file on `pool`, in parallel members for BGZF and from one
+    stream otherwise. `_server.station_names` must be set before the pool forks.
+    Returns the merged StationTable.
+    """
+    mapping = _server.mapped_file(file_name)
+    blocks = bgzf_blocks(mapping)
+    if blocks is not None:
+        tasks = [(file_name, start, end, window_size, engine) for start, end in group_blocks(blocks, chunk_size)]
+        results = ordered_results(pool, decompress_task, tasks, 2 * workers)
+    else:
+        tasks = ((piece, window_size, engine) for piece in stream_pieces(file_name, chunk_size))
+        results = ordered_results(pool, buffer_task, tasks, 2 * workers)
+
+    result = StationTable(_server.station_names)
+    lines, carry = [], b""
+    for table, head, tail in results:
+        result.merge(table)
+        if tail is None:
+            carry += head
+        else:
+            lines.append(carry + head)
+            carry = tail
+    lines.append(carry)
+    lines = [line for line in lines if line]
+    if lines:
+        load_engine(engine)(b"\n".join(lines), result)
+    return result
+
+
+def process_compressed(
+    file_name,
+    workers=None,
+    chunk_size=CHUNK_SIZE,
+    window_size=WINDOW_SIZE,
+    engine="python",
+    stations_file=None,
+    output_format="lines",
+    order="bytes",
+):
+    """
+    Aggregates a gzip file on a pool of forked workers and writes the results.
+    """
+    _server.station_names = load_station_names(stations_file) if stations_file else ()
+    load_engine(engine)  # fail early if the engine cannot be imported
+    workers = workers or mp.cpu_count()
+    with mp.get_context("fork").Pool(workers) as pool:
+        table = aggregate_compressed(pool, file_name, workers, chunk_size, window_size, engine)
+    write_results(table.items(), output_format, order)
@@ -0,0 +1,272 @@
+"""
+Aggregation across several hosts for jelle.py (`--agent ADDRESS[=PATH]`, repeatable).
+
+The agents are ordinary servers (`jelle.py --serve HOST:PORT`, see _server.py) on the
+machines that hold the data. The coordinator splits a FILE on storage every agent
+can read into byte ranges of `range_size`. For `--agent ADDRESS=PATH` it assigns the
+whole file PATH on that agent's host to that agent alone. Every range is sent with
+`"partial": true`, so the agent aggregates it on its warm pool and answers with the
+names and columns of the partial table. The coordinator merges the partials with
+`StationTable.merge_columns`, like checkpointed state, and writes the results.
+
+Each agent gets one connection and one coordinator thread, which takes the next range
+as soon as the previous one is answered, so faster hosts take more ranges. A range
+whose request fails (refused or lost connection, timeout, error response) goes back
+to the front of the list. Failures are counted per range and agent: a range is next
+taken by the agents that failed it the fewest times, so it is not handed back to the
+agent that just failed it while another one is left, and every agent may fail it up
+to `retries + 1` times. An agent that fails `retries + 1` times in a row is dropped,
+after backing off between attempts, and the run only fails once a range is left that
+no remaining agent may take. Ranges of a per-host file can only be retried on their
+own agent.
+
+Several agents on localhost ports stand in for several hosts:
+
+    python entries/jelle.py --serve 127.0.0.1:9001 --workers 2 &
+    python entries/jelle.py --serve 127.0.0.1:9002 --workers 2 &
+    python entries/jelle.py measurements.txt --agent 127.0.0.1:9001 --agent 127.0.0.1:9002
+"""
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from _output import write_results
+from _server import Connection, merge_partial
+from _stations import StationTable
+
+# Default size of the byte ranges of a shared file; agents split them further into
+# chunks for their own pools.
+RANGE_SIZE = 64 * 1024 * 1024
+RETRIES = 3
+# Seconds an agent may take to accept a connection or answer one range
+TIMEOUT = 600
+# Seconds before reconnecting to an agent after its first failure, doubled after each
+BACKOFF = 0.1
+
+
+def parse_agent(spec):
+    """
+    Splits `ADDRESS[=PATH]` into (address, path), where path is None for an agent of
+    the shared file.
+    """
+    address, sep, path = spec.partition("=")
+    return address, path if sep else None
+
+
+class RangeTask:
+    """
+    One request of the coordinator: a byte range of `path`, or the whole file if
+    `ranges` is None, for any agent of the shared file or only for `agent`.
+    """
+
+    def __init__(self, path, ranges=None, agent=None):
+        self.path = path
+        self.ranges = ranges
+        self.agent = agent
+        # Failures per agent address
+        self.failures = {}
+
+    def __str__(self):
+        where = "" if self.ranges is None else " bytes {}:{}".format(*self.ranges[0])
+        return f"{self.path}{where}"
+
+
+def plan_tasks(file_name, agents, range_size=RANGE_SIZE):
+    """
+    Returns the RangeTasks for `agents` ((address, path) pairs): `file_name` cut
+    into ranges of `range_size` for the agents without a path, and one task per agent
+    with a path.
+    """
+    tasks = []
+    if file_name is not None:
+        path = os.path.abspath(file_name)
+        size = os.path.getsize(path)
+        tasks += [RangeTask(path, [[start, min(start + range_size, size)]]) for start in range(0, size, range_size)]
+    tasks += [RangeTask(path, agent=address) for address, path in agents if path is not None]
+    return tasks
+
+
+class Coordinator:
+    """
+    Hands out RangeTasks to the agent threads, merges their partials and requeues
+    failed tasks. `error` is set once the run cannot finish.
+    """
+
+    def __init__(self, tasks, shared_agents, retries=RETRIES):
+        self.pending = deque(tasks)
+        self.in_flight = 0
+        self.retries = retries
+        # Agents of the shared file that are still alive
+        self.shared_agents = set(shared_agents)
+        self.retired = set()
+        self.table = StationTable()
+        self.assigned = {}
+        self.error = None
+        self.condition = threading.Condition()
+
+    def can_take(self, task, address, shared):
+        """
+        Whether the agent may take the task now: it is the task's own agent, or an
+        agent of the shared file among those that failed the task the fewest times.
+        Either way it must not have failed the task more than `retries` times.
+        """
+        failures = task.failures.get(address, 0)
+        if failures > self.retries:
+            return False
+        if task.agent is not None:
+            return task.agent == address
+        return (
+            shared
+            and address in self.shared_agents
+            and failures == min(task.failures.get(agent, 0) for agent in self.shared_agents)
+        )
+
+    def has_agent(self, task):
+        """
+        Whether some remaining agent may still take the task.
+        """
+        agents = self.shared_agents if task.agent is None else {task.agent} - self.retired
+        return any(task.failures.get(agent, 0) <= self.retries for agent in agents)
+
+    def next_task(self, address, shared):
+        """
+        Blocks until there is a task for this agent and returns it, or returns None
+        once every task is done or the run failed.
+        """
+        with self.condition:
+            while self.error is None:
+                for task in self.pending:
+                    if self.can_take(task, address, shared):
+                        self.pending.remove(task)
+                        self.in_flight += 1
+                        return task
+                if not self.pending and not self.in_flight:
+                    break
+                self.condition.wait()
+            return None
+
+    def done(self, task, address, partial):
+        with self.condition:
+            merge_partial(self.table, partial)
+            self.assigned[address] = self.assigned.get(address, 0) + 1
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def failed(self, task, address, error):
+        with self.condition:
+            self.in_flight -= 1
+            task.failures[address] = task.failures.get(address, 0) + 1
+            if not self.has_agent(task):
+                self.error = f"{task} failed {sum(task.failures.values())} times, last on {address}: {error}"
+            else:
+                print(f"agent {address}: {task} failed ({error}), retrying", file=sys.stderr)
+                self.pending.appendleft(task)
+            self.condition.notify_all()
+
+    def retire(self, address):
+        """
+        Drops an agent that keeps failing; the tasks it failed are already back in
+        the list for the other agents. Fails the run if some task is left that no
+        remaining agent may take.
+        """
+        with self.condition:
+            print(f"agent {address}: dropped after {self.retries + 1} failures in a row", file=sys.stderr)
+            self.shared_agents.discard(address)
+            self.retired.add(address)
+            for task in self.pending:
+                if not self.has_agent(task):
+                    self.error = f"no agent left for {task}"
+                    break
+            self.condition.notify_all()
+
+
+def run_agent(coordinator, address, shared, engine=None, timeout=TIMEOUT):
+    """
+    The coordinator thread of one agent: sends it tasks over one connection until
+    none are left, reconnecting with backoff after failures.
+    """
+    connection = None
+    failures = 0
+    try:
+        while (task := coordinator.next_task(address, shared)) is not None:
+            message = {"path": task.path, "partial": True}
+            if task.ranges is not None:
+                message["ranges"] = task.ranges
+            if engine:
+                message["engine"] = engine
+            try:
+                if connection is None:
+                    connection = Connection(address, timeout)
+                partial = connection.send(message)["partial"]
+            except (OSError, ValueError, RuntimeError) as e:
+                # OSError covers refused, reset and timed out connections, ValueError
+                # a garbled response; either way the connection is not reused
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                coordinator.failed(task, address, e)
+                failures += 1
+                if failures > coordinator.retries:
+                    coordinator.retire(address)
+                    return
+                time.sleep(BACKOFF * 2 ** (failures - 1))
+                continue
+            failures = 0
+            coordinator.done(task, address, partial)
+    finally:
+        if connection is not None:
+            connection.close()
+
+
+def aggregate_distributed(
+    file_name, agents, range_size=RANGE_SIZE, engine=None, retries=RETRIES, timeout=TIMEOUT
+):
+    """
+    Aggregates `file_name` (shared by the agents without a path, may be None) and
+    the per-host files of `agents` (`ADDRESS[=PATH]` strings) on the agents.
+
+    Returns:
+        (table, assigned): the merged StationTable, and the number of tasks each
+        agent answered.
+    """
+    agents = [parse_agent(spec) for spec in agents]
+    shared_agents = [address for address, path in agents if path is None]
+    if file_name is None and shared_agents:
+        raise ValueError(f"agents {', '.join(shared_agents)} have no file: give a FILE or ADDRESS=PATH")
+    if file_name is not None and not shared_agents:
+        raise ValueError(f"no agent for {file_name}: give at least one --agent without =PATH")
+    coordinator = Coordinator(plan_tasks(file_name, agents, range_size), shared_agents, retries)
+    threads = [
+        threading.Thread(target=run_agent, args=(coordinator, address, path is None, engine, timeout), daemon=True)
+        for address, path in agents
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if coordinator.error is not None:
+        raise RuntimeError(coordinator.error)
+    return coordinator.table, coordinator.assigned
+
+
+def process_distributed(
+    file_name,
+    agents,
+    range_size=RANGE_SIZE,
+    engine=None,
+    retries=RETRIES,
+    timeout=TIMEOUT,
+    output_format="lines",
+    order="bytes",
+):
+    """
+    Aggregates on the agents, see `aggregate_distributed`, and writes the results.
+    """
+    table, assigned = aggregate_distributed(file_name, agents, range_size, engine, retries, timeout)
+    write_results(table.items(), output_format, order)
+    print(
+        "tasks per agent: " + ", ".join(f"{address} {count}" for address, count in sorted(assigned.items())),
+        file=sys.stderr,
+    )
@@ -0,0 +1,202 @@
+"""
+Per-station temperature histograms for jelle.py (`--histogram`, `--quantiles`).
+
+Measurements are integer tenths in [-99.9, 99.9], so an exact histogram has one
+bucket per possible value: 1,999 uint32 counters (8 KB) per station. A HistogramTable
+keeps them in one flat `array('I')`, but a station's block is only appended on its
+first row, so stations that were preloaded or merged but never measured cost nothing.
+Merging only touches the stations the other table has measurements for. Each of their
+blocks is read as one little-endian integer and added to the station's running sum,
+which adds bucket-wise as long as no bucket carries over; the sums are only written
+back to the blocks when the histograms are read.
+
+From the merged buckets, quantiles are exact (nearest rank) and the variance is
+computed from integer sums of squares. A bucket holds at most 2**32 - 1 rows of one
+station and temperature; every station's buckets are checked against its count.
+"""
+import math
+import sys
+from array import array
+from bisect import bisect_left
+from fractions import Fraction
+from functools import lru_cache
+from itertools import accumulate
+
+from _output import format_tenths
+from _stations import MAX_TENTHS, MIN_TENTHS, StationTable
+
+BUCKETS = MAX_TENTHS - MIN_TENTHS + 1
+BUCKET_BYTES = 4 * BUCKETS
+
+# Quantiles reported by default, in percent
+QUANTILES = (50.0, 95.0, 99.0)
+
+def buffer_to_int(buffer):
+    """
+    Reads a buffer of native uint32 buckets as one little-endian integer.
+    """
+    if sys.byteorder == "big":
+        buffer = array("I", buffer)
+        buffer.byteswap()
+    return int.from_bytes(buffer, "little")
+
+
+def int_to_buckets(value):
+    """
+    The inverse of `buffer_to_int` for one station: its BUCKETS uint32 as an array.
+    """
+    buckets = array("I")
+    buckets.frombytes(value.to_bytes(BUCKET_BYTES, "little"))
+    if sys.byteorder == "big":
+        buckets.byteswap()
+    return buckets
+
+
+def parse_quantiles(text):
+    """
+    Parses comma-separated percentages such as `50,95,99.9`.
+    """
+    quantiles = tuple(float(value) for value in text.split(","))
+    if not all(0 < q <= 100 for q in quantiles):
+        raise ValueError(f"quantiles must be in (0, 100], got {text!r}")
+    return quantiles
+
+
+@lru_cache
+def quantile_ratios(quantiles):
+    """
+    Returns a (key, numerator, denominator) triple per quantile, with q / 100 exact in
+    the percentage as written: 99.9% of 1000 rows is rank 999, not 1000. Cached, as
+    every station is summarized with the same quantiles.
+    """
+    ratios = []
+    for q in quantiles:
+        ratio = Fraction(str(q)) / 100
+        ratios.append((f"p{q:g}", ratio.numerator, ratio.denominator))
+    return tuple(ratios)
+
+
+def summarize(buckets, count, total, quantiles=QUANTILES, low=MIN_TENTHS):
+    """
+    Returns {"p50": "18.0", ..., "variance": "...", "stddev": "..."} for the buckets of
+    one station with `count` measurements summing to `total` tenths, formatted as
+    strings that are also valid JSON numbers. The first bucket is the temperature
+    `low` (in tenths), so the empty buckets below a station's minimum can be left out.
+    """
+    cumulative = list(accumulate(buckets))
+    if cumulative[-1] != count:
+        raise OverflowError("a histogram bucket exceeded 2**32 - 1 rows")
+    summary = {}
+    for key, numerator, denominator in quantile_ratios(quantiles):
+        rank = max(1, -(-numerator * count // denominator))
+        summary[key] = format_tenths(bisect_left(cumulative, rank) + low)
+    # Population variance in tenths squared, exact up to the final division. It is the
+    # same for the bucket positions i as for the temperatures, and with C the cumulative
+    # counts, sum(c_i * i * i) = sum((2j + 1) * (count - C_j)) over j < last: sums of C
+    # and of its running sums, which cost one pass over `cumulative`.
+    last = len(cumulative) - 1
+    linear = total - low * count  # sum(c_i * i)
+    below = last * count - linear  # sum(C_j)
+    running = sum(accumulate(cumulative)) - below - count  # sum(C_0 + ... + C_j)
+    squares = last * last * count - 2 * (last * below - running) - below
+    variance = (count * squares - linear * linear) / (count * count) / 100
+    summary["variance"] = f"{variance:.2f}"
+    summary["stddev"] = f"{math.sqrt(variance):.2f}"
+    return summary
+
+
+class HistogramTable(StationTable):
+    """
+    A StationTable that also counts every station's measurements per temperature.
+
+    The hot loop binds `buckets` and `offsets` to locals and does
+    `buckets[offsets[station] + measurement] += 1`, where a station's offset already
+    includes the shift from tenths to bucket positions. The offset is None until the
+    station's first row, when the loop calls `allocate`; `buckets` grows in place, so
+    the locals stay valid.
+    """
+
+    def __init__(self, names=()):
+        self.buckets = array("I")
+        self.offsets = []
+        # Merged buckets per station not yet added to `buckets`, see `merge_buckets`
+        self.pending = {}
+        super().__init__(names)
+
+    def add(self, name):
+        station = super().add(name)
+        self.offsets.append(None)
+        return station
+
+    def allocate(self, station, block=None):
+        """
+        Appends a station's buckets, zeroed or copied from the buffer `block`.
+        """
+        self.offsets[station] = len(self.buckets) - MIN_TENTHS
+        self.buckets.frombytes(bytes(BUCKET_BYTES) if block is None else memoryview(block).cast("B"))
+
+    def merge(self, other):
+        super().merge(other)
+        self.merge_buckets(other.names, other.preloaded, other.counts, other.buckets, other.offsets)
+
+    def merge_buckets(self, names, preloaded, counts, buckets, offsets):
+        """
+        Adds another table's buckets to this one, for every station of `names` with
+        measurements. `offsets` locate its blocks in `buckets` (uint32 items) the way
+        this table's own `offsets` do. Runs after `merge_columns`, which interned the
+        names. The sums are only unpacked by `flush`.
+        """
+        shared = min(self.preloaded, preloaded)
+        ids, pending = self.ids, self.pending
+        for station, count in enumerate(counts):
+            if count:
+                start = offsets[station] + MIN_TENTHS
+                own = station if station < shared else ids[names[station]]
+                pending[own] = pending.get(own, 0) + buffer_to_int(buckets[start:start + BUCKETS])
+
+    def flush(self):
+        """
+        Adds the merged buckets to `buckets`.
+        """
+        for station, value in self.pending.items():
+            offset = self.offsets[station]
+            if offset is None:
+                self.allocate(station, int_to_buckets(value))
+            else:
+                start = offset + MIN_TENTHS
+                total = buffer_to_int(self.buckets[start:start + BUCKETS]) + value
+                self.buckets[start:start + BUCKETS] = int_to_buckets(total)
+        self.pending = {}
+
+    def histogram(self, station):
+        """
+        Returns a station's buckets, from -99.9 up to 99.9.
+        """
+        self.flush()
+        offset = self.offsets[station]
+        if offset is None:
+            return array("I", bytes(BUCKET_BYTES))
+        start = offset + MIN_TENTHS
+        return self.buckets[start:start + BUCKETS]
+
+    def summary_items(self, quantiles=QUANTILES):
+        """
+        Like `items`, with each station's `summarize` dict as a fifth value. Only
+        the buckets from the station's minimum to its maximum are summarized.
+        """
+        self.flush()
+        buckets, offsets, ids = self.buckets, self.offsets, self.ids
+        for name, (m_min, m_max, m_sum, m_count) in self.items():
+            offset = offsets[ids[name]]
+            summary = summarize(buckets[offset + m_min:offset + m_max + 1], m_count, m_sum, quantiles, m_min)
+            yield name, (m_min, m_max, m_sum, m_count, summary)
+
+    def __getstate__(self):
+        self.flush()
+        return dict(super().__getstate__(), buckets=self.buckets, offsets=self.offsets)
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.buckets = state["buckets"]
+        self.offsets = state["offsets"]
+        self.pending = {}
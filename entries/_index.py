@@ -0,0 +1,214 @@
+"""
+Block summary (zone-map) index for jelle.py (`--build-index`, `--rows`).
+
+The file is cut into fixed-size newline-aligned blocks (64 MiB by default), and the
+index stores every block's row count and per-station [min, max, sum, count]. A query
+for a row range and/or a subset of stations combines the stored summaries of the
+blocks it fully covers, and only parses the partial blocks at its edges.
+
+Layout of the `FILE.idx` sidecar (native byte order, int64 throughout):
+    header   magic, source size, source mtime_ns, block_size, n_blocks, n_entries, names_len
+    blocks   start, end, rows, first_entry, n_entries per block
+    entries  station ids, mins, maxs, sums, counts; one column of n_entries each
+    names    b"\\n"-joined station dictionary; a name's position is its id
+
+Like the binary cache, the index records the size and mtime of the file it was
+built from, and a stale index is rebuilt.
+"""
+import mmap
+import multiprocessing as mp
+import os
+import struct
+import sys
+from array import array
+
+from _chunker import iter_windows, split_range
+from _scan import WINDOW_SIZE, load_engine, open_mapping, process_chunk
+from _stations import StationTable
+
+MAGIC = b"1brcidx1"
+HEADER = struct.Struct("=8sqqqqqq")
+BLOCK_FIELDS = 5
+BLOCK_SIZE = 64 * 1024 * 1024
+
+# The mapped source file the pool workers summarize blocks of, opened by the parent
+# before it forks.
+source = None
+
+
+def index_path(file_name):
+    return f"{file_name}.idx"
+
+
+def summarize_block(task):
+    """
+    Aggregates one block into a fresh StationTable. Runs in a pool worker.
+    """
+    start, end, window_size, engine = task
+    table = StationTable()
+    process_chunk(source, start, end, table, window_size, load_engine(engine))
+    return table
+
+
+def build_index(file_name, block_size=BLOCK_SIZE, workers=None, window_size=WINDOW_SIZE, engine="python"):
+    """
+    Summarizes every block of `file_name` on a pool of forked workers and writes the
+    index atomically. Returns the opened BlockIndex.
+    """
+    global source
+    stat = os.stat(file_name)
+    source = open_mapping(file_name)
+    blocks = split_range(source, 0, len(source), block_size)
+    tasks = [(start, end, window_size, engine) for start, end in blocks]
+
+    ids = {}
+    block_rows = array("q")
+    entries = [array("q") for _ in range(5)]
+    with mp.get_context("fork").Pool(min(workers or mp.cpu_count(), len(tasks) or 1)) as pool:
+        for (start, end), table in zip(blocks, pool.imap(summarize_block, tasks)):
+            first = len(entries[0])
+            rows = 0
+            for name, (m_min, m_max, m_sum, m_count) in table.items():
+                station = ids.setdefault(name, len(ids))
+                for column, value in zip(entries, (station, m_min, m_max, m_sum, m_count)):
+                    column.append(value)
+                rows += m_count
+            block_rows.extend((start, end, rows, first, len(entries[0]) - first))
+
+    path = index_path(file_name)
+    names = b"\n".join(ids)
+    with open(f"{path}.tmp", "wb") as out:
+        out.write(HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, block_size, len(blocks), len(entries[0]), len(names)))
+        block_rows.tofile(out)
+        for column in entries:
+            column.tofile(out)
+        out.write(names)
+    os.replace(f"{path}.tmp", path)
+    return BlockIndex(path)
+
+
+class BlockIndex:
+    """
+    Read-only mapping of an index file. `blocks` lists (start, end, rows, first_entry,
+    n_entries) per block, `entries` holds the five entry columns as memoryviews.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self.mm, 0)
+        magic, self.source_size, self.source_mtime_ns, self.block_size, n_blocks, n_entries, names_len = header
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a block index")
+        view = memoryview(self.mm)[HEADER.size:]
+        blocks = view[:8 * BLOCK_FIELDS * n_blocks].cast("q").tolist()
+        self.blocks = [tuple(blocks[i:i + BLOCK_FIELDS]) for i in range(0, len(blocks), BLOCK_FIELDS)]
+        offset = 8 * BLOCK_FIELDS * n_blocks
+        self.entries = []
+        for _ in range(5):
+            self.entries.append(view[offset:offset + 8 * n_entries].cast("q"))
+            offset += 8 * n_entries
+        names = bytes(view[offset:offset + names_len])
+        self.names = names.split(b"\n") if names else []
+        self.rows = sum(block[2] for block in self.blocks)
+
+
+def open_index(file_name):
+    """
+    Returns the BlockIndex for `file_name` if one exists and still matches the file's
+    size and mtime, otherwise None.
+    """
+    path = index_path(file_name)
+    if not os.path.exists(path):
+        return None
+    index = BlockIndex(path)
+    stat = os.stat(file_name)
+    if (index.source_size, index.source_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        print(f"index {path} is out of date, rebuilding it", file=sys.stderr)
+        return None
+    return index
+
+
+def parse_row_range(text, total):
+    """
+    Parses `START:END` into a row range, with Python slice semantics: either side
+    may be empty and negative values count from the end (`-1000000:` is the last
+    million rows).
+    """
+    start, sep, end = text.partition(":")
+    if not sep:
+        raise ValueError(f"row range {text!r} is not START:END")
+    try:
+        return slice(int(start) if start else None, int(end) if end else None).indices(total)[:2]
+    except ValueError:
+        raise ValueError(f"row range {text!r} is not START:END with integer bounds") from None
+
+
+def query(index, mapping, rows=None, row_filter=None, window_size=WINDOW_SIZE, engine="python"):
+    """
+    Returns a StationTable for the rows in `rows` (a (start, end) row range, default
+    all rows), restricted to the station names that pass `row_filter` if given.
+    Block summaries cannot be split by temperature, so the filter must not have a
+    temperature range.
+
+    Blocks inside the range are answered from their stored summaries; for the at most
+    two blocks the range only partly covers, the wanted lines are parsed from the
+    file's `mapping`.
+    """
+    start_row, end_row = rows if rows is not None else (0, index.rows)
+    table = StationTable(index.names)
+    wanted = None
+    if row_filter is not None:
+        if row_filter.filters_temperatures:
+            raise ValueError("the block index cannot answer temperature ranges")
+        wanted = {station for station, name in enumerate(index.names) if row_filter.accepts_name(name)}
+    ids, mins, maxs, sums, counts = index.entries
+    window_processor = load_engine(engine, row_filter=row_filter)
+
+    block_row = 0
+    for start, end, block_rows, first, n_entries in index.blocks:
+        lo = max(start_row - block_row, 0)
+        hi = min(end_row - block_row, block_rows)
+        block_row += block_rows
+        if lo >= hi:
+            continue
+        if lo == 0 and hi == block_rows:
+            for entry in range(first, first + n_entries):
+                station = ids[entry]
+                if wanted is None or station in wanted:
+                    table.update(station, mins[entry], maxs[entry], sums[entry], counts[entry])
+        else:
+            # An edge block: walk it a window at a time, counting lines, and parse only
+            # the lines in [lo, hi) of it
+            partial = StationTable(index.names)
+            row = 0
+            for window_start, window_end in iter_windows(mapping, start, end, window_size):
+                if row >= hi:
+                    break
+                window = mapping[window_start:window_end]
+                n_lines = window.count(b"\n") + 1
+                if row + n_lines > lo:
+                    if row < lo or row + n_lines > hi:
+                        window = b"\n".join(window.split(b"\n")[max(lo - row, 0):hi - row])
+                    window_processor(window, partial)
+                row += n_lines
+            for station, count in enumerate(partial.counts):
+                if count:
+                    table.update(station, partial.mins[station], partial.maxs[station], partial.sums[station], count)
+    return table
+
+
+def query_file(
+    file_name, rows=None, row_filter=None, block_size=BLOCK_SIZE, workers=None, window_size=WINDOW_SIZE,
+    engine="python", rebuild=False,
+):
+    """
+    Answers a query from the index of `file_name`, building the index first if it is
+    missing, stale or `rebuild` is set. `rows` is a `START:END` string, see
+    `parse_row_range`.
+    """
+    index = None if rebuild else open_index(file_name)
+    if index is None:
+        index = build_index(file_name, block_size, workers, window_size, engine)
+    row_range = parse_row_range(rows, index.rows) if rows else None
+    return query(index, open_mapping(file_name), row_range, row_filter, window_size, engine)
@@ -0,0 +1,114 @@
+"""
+Opt-in instrumentation for jelle.py (`--instrument`, `--instrument-json`, `--cprofile`).
+
+Workers time their hot path per phase (with the python engine: line splitting,
+parsing and aggregation; with other engines: whole windows) and the time it takes to
+serialize their table into shared memory. The parent times mapping the file, the
+chunk boundary search, the workers and the merge. Everything is collected into one
+report, printed as a table or written as JSON. With `--cprofile DIR` every worker
+also runs under cProfile and dumps `DIR/worker-N.prof`, which the parent merges
+into `DIR/merged.prof`.
+"""
+import glob
+import io
+import json
+import os
+import pstats
+import sys
+import time
+
+# Worker phases in report order; "windows" is used by engines without a breakdown
+WORKER_PHASES = ("split", "parse", "aggregate", "windows", "serialize")
+PARENT_PHASES = ("map", "chunking", "workers", "merge", "output")
+
+
+def timed(window_processor, phase_times):
+    """
+    Wraps a window processor so the time spent in it is added to
+    `phase_times["windows"]`.
+    """
+
+    def timed_window_processor(data, table):
+        t0 = time.perf_counter()
+        window_processor(data, table)
+        phase_times["windows"] = phase_times.get("windows", 0.0) + time.perf_counter() - t0
+
+    return timed_window_processor
+
+
+def profile_path(profile_dir, worker_id):
+    return os.path.join(profile_dir, f"worker-{worker_id}.prof")
+
+
+def merge_profiles(profile_dir, top=20):
+    """
+    Merges every worker's profile in `profile_dir` into `merged.prof` and prints the
+    `top` functions by own time to stderr.
+    """
+    paths = sorted(glob.glob(os.path.join(profile_dir, "worker-*.prof")))
+    if not paths:
+        return
+    merged = os.path.join(profile_dir, "merged.prof")
+    report = io.StringIO()
+    stats = pstats.Stats(*paths, stream=report)
+    stats.dump_stats(merged)
+    stats.strip_dirs().sort_stats("tottime").print_stats(top)
+    print(f"\ncProfile of {len(paths)} worker(s), merged into {merged}:", file=sys.stderr)
+    print(report.getvalue(), file=sys.stderr)
+
+
+def build_report(parent_phases, worker_stats, elapsed):
+    """
+    Returns the report as a JSON-serializable dict: parent phases, per-worker stats
+    with their throughput, and totals.
+    """
+    workers = []
+    for stats in sorted(worker_stats, key=lambda s: s["worker"]):
+        stats = dict(stats)
+        busy = stats["busy"] or float("inf")
+        stats["rows_per_second"] = stats.get("rows", 0) / busy
+        stats["bytes_per_second"] = stats.get("bytes", 0) / busy
+        workers.append(stats)
+    rows = sum(s.get("rows", 0) for s in worker_stats)
+    size = sum(s.get("bytes", 0) for s in worker_stats)
+    return {
+        "parent": parent_phases,
+        "workers": workers,
+        "total": {
+            "seconds": elapsed,
+            "rows": rows,
+            "bytes": size,
+            "rows_per_second": rows / elapsed if elapsed else 0.0,
+            "bytes_per_second": size / elapsed if elapsed else 0.0,
+        },
+    }
+
+
+def print_report(report):
+    """
+    Prints a report from `build_report` as tables to stderr.
+    """
+    phases = [p for p in WORKER_PHASES if any(p in w.get("phases", {}) or p in w for w in report["workers"])]
+    header = "worker      rows       MiB   busy(s)" + "".join(f"{p + '(s)':>13}" for p in phases) + "     Mrows/s    MiB/s"
+    print("\n" + header, file=sys.stderr)
+    for w in report["workers"]:
+        timings = dict(w.get("phases", {}), serialize=w.get("serialize", 0.0))
+        print(
+            f"{w['worker']:>6}  {w.get('rows', 0):>8}  {w.get('bytes', 0) / 2**20:>8.1f}  {w['busy']:>8.2f}"
+            + "".join(f"{timings.get(p, 0.0):>13.3f}" for p in phases)
+            + f"  {w['rows_per_second'] / 1e6:>10.2f}  {w['bytes_per_second'] / 2**20:>7.1f}",
+            file=sys.stderr,
+        )
+    parent = report["parent"]
+    print("parent  " + "  ".join(f"{p} {parent[p]:.3f}s" for p in PARENT_PHASES if p in parent), file=sys.stderr)
+    total = report["total"]
+    print(
+        f"total   {total['rows']} rows, {total['bytes'] / 2**20:.1f} MiB in {total['seconds']:.2f}s: "
+        f"{total['rows_per_second'] / 1e6:.2f} Mrows/s, {total['bytes_per_second'] / 2**20:.1f} MiB/s",
+        file=sys.stderr,
+    )
+
+
+def write_report(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,92 @@
+"""
+Kernel I/O advice for the memory-mapped scan of jelle.py (`--io-policy`, `--hugepages`).
+
+With no advice, the kernel reads a mapping ahead only as far as its fault heuristics
+guess, and every page a worker touched stays mapped in the worker (counted in its RSS)
+and cached until memory runs short. The policies:
+
+    default     no advice
+    sequential  MADV_SEQUENTIAL on every chunk, for aggressive readahead, and
+                MADV_WILLNEED on the window after the one being parsed, so the kernel
+                reads it in while the worker is still busy
+    stream      sequential, and every parsed window is dropped: MADV_DONTNEED unmaps
+                it from the worker, so its RSS stays around one window, and
+                POSIX_FADV_DONTNEED evicts it from the page cache, so scanning a file
+                larger than RAM does not push out other processes' pages
+
+With `hugepages`, MADV_HUGEPAGE is also requested for every chunk. Advice is only a
+hint: where the platform lacks an option or refuses it (many kernels only back
+anonymous memory with huge pages), it is skipped and the scan is unchanged.
+"""
+import mmap
+import os
+
+POLICIES = ("default", "sequential", "stream")
+
+PAGE_MASK = ~(mmap.PAGESIZE - 1)
+
+
+def advise(mapping, option, start, end):
+    """
+    Applies madvise `option` (None if the platform lacks it) to the pages that
+    overlap [start, end) of `mapping`. Returns whether the kernel accepted it.
+    """
+    start &= PAGE_MASK
+    if option is None or end <= start or not hasattr(mapping, "madvise"):
+        return False
+    try:
+        mapping.madvise(option, start, end - start)
+    except OSError:
+        return False
+    return True
+
+
+class IoPolicy:
+    """
+    The advice of one policy for `file_name`, given by `process_chunk` around every
+    chunk and window it scans. Holds no mapping, so it can be pickled for workers that
+    map the file themselves; the descriptor used for fadvise is opened per process.
+    """
+
+    def __init__(self, file_name, policy="sequential", hugepages=False):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown I/O policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        self.file_name = file_name
+        self.sequential = policy != "default"
+        self.drop = policy == "stream"
+        self.hugepages = hugepages
+        self.fd = None
+
+    def __getstate__(self):
+        return dict(self.__dict__, fd=None)
+
+    def chunk(self, mapping, start, end, window_size):
+        """
+        Advises a chunk before its first window is parsed.
+        """
+        if self.hugepages:
+            advise(mapping, getattr(mmap, "MADV_HUGEPAGE", None), start, end)
+        if self.sequential:
+            advise(mapping, getattr(mmap, "MADV_SEQUENTIAL", None), start, end)
+            advise(mapping, getattr(mmap, "MADV_WILLNEED", None), start, min(start + window_size, end))
+
+    def ahead(self, mapping, start, end):
+        """
+        Advises the range the next window will come from, before parsing this one.
+        """
+        if self.sequential:
+            advise(mapping, getattr(mmap, "MADV_WILLNEED", None), start, end)
+
+    def behind(self, mapping, start, end):
+        """
+        Drops a parsed window. Only whole pages below `end` go, so the page the next
+        window starts in stays.
+        """
+        if not self.drop:
+            return
+        end &= PAGE_MASK
+        advise(mapping, getattr(mmap, "MADV_DONTNEED", None), start, end)
+        if hasattr(os, "posix_fadvise") and end > start & PAGE_MASK:
+            if self.fd is None:
+                self.fd = os.open(self.file_name, os.O_RDONLY)
+            os.posix_fadvise(self.fd, start & PAGE_MASK, end - (start & PAGE_MASK), os.POSIX_FADV_DONTNEED)
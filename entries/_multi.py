@@ -0,0 +1,153 @@
+"""
+Multi-file input for jelle.py (several FILEs, a directory or a glob pattern).
+
+The chunks of all files go into one task list, largest first, for one pool of
+forked workers. A batch of small shards then pays for one fork and one merge instead
+of one per file. The workers map files on demand through the server's per-process
+LRU (`_server.mapped_file`), so no process keeps more than `max_open` files mapped.
+Each chunk's table comes back tagged with its file and is merged into that file's
+table; the combined table is the merge of the per-file ones. Gzip-compressed files
+cannot be split into byte chunks; they are aggregated on the same pool afterwards,
+see _compressed.py.
+"""
+import glob
+import multiprocessing as mp
+import os
+
+import _server
+from _chunker import split_range
+from _compressed import aggregate_compressed, is_gzip
+from _output import write_results
+from _scan import CHUNK_SIZE, WINDOW_SIZE, load_engine
+from _stations import StationTable, load_station_names
+
+# Sidecars written next to a measurements file, which are never inputs themselves
+SIDECAR_SUFFIXES = (".ckpt", ".cache", ".idx", ".tmp")
+
+# File extension of the per-file results for each output format
+EXTENSIONS = {"lines": ".txt", "1brc": ".txt", "csv": ".csv", "jsonl": ".jsonl"}
+
+
+def expand_inputs(inputs):
+    """
+    Expands files, directories (their non-hidden regular files) and glob patterns
+    into a list of distinct paths: in the order given, each directory and pattern
+    sorted by name.
+    """
+    paths = {}
+    for item in inputs:
+        if os.path.isdir(item):
+            found = sorted(entry.path for entry in os.scandir(item) if entry.is_file() and not entry.name.startswith("."))
+        elif not os.path.exists(item) and glob.has_magic(item):
+            found = sorted(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+        else:
+            found = [item]
+        for path in found:
+            if not path.endswith(SIDECAR_SUFFIXES):
+                paths.setdefault(os.path.abspath(path), path)
+    if not paths:
+        raise FileNotFoundError(f"no input files in {', '.join(inputs)}")
+    return list(paths.values())
+
+
+def plan_chunks(paths, chunk_size=CHUNK_SIZE, window_size=WINDOW_SIZE, engine="python"):
+    """
+    Returns the (file_index, chunk_task) pairs for every chunk of every file, largest
+    chunks first so the last ones handed out are small. A chunk task is what
+    `_server.aggregate_chunk` takes. Compressed files are left out.
+    """
+    tasks = []
+    for file_index, path in enumerate(paths):
+        if os.path.getsize(path) == 0 or is_gzip(path):
+            continue  # an empty file cannot be mapped
+        mapping = _server.mapped_file(path)
+        for start, end in split_range(mapping, 0, len(mapping), chunk_size):
+            tasks.append((file_index, (path, start, end, window_size, engine)))
+    tasks.sort(key=lambda task: task[1][2] - task[1][1], reverse=True)
+    return tasks
+
+
+def aggregate_task(task):
+    """
+    Aggregates one chunk and returns it with the index of its file. Runs in a pool
+    worker.
+    """
+    file_index, chunk = task
+    return file_index, _server.aggregate_chunk(chunk)
+
+
+def aggregate_files(
+    paths,
+    workers=None,
+    chunk_size=CHUNK_SIZE,
+    window_size=WINDOW_SIZE,
+    engine="python",
+    stations_file=None,
+    max_open=_server.MAX_MAPPED,
+):
+    """
+    Aggregates all chunks of `paths` on one pool of forked workers.
+
+    Returns:
+        (combined, per_file): the StationTable of all files together, and a list with
+        the StationTable of each file, in the order of `paths`.
+    """
+    _server.station_names = load_station_names(stations_file) if stations_file else ()
+    _server.max_mapped = max_open
+    load_engine(engine)  # fail early if the engine cannot be imported
+    tasks = plan_chunks(paths, chunk_size, window_size, engine)
+    compressed = [file_index for file_index, path in enumerate(paths) if os.path.getsize(path) and is_gzip(path)]
+
+    per_file = [StationTable(_server.station_names) for _ in paths]
+    workers = workers or mp.cpu_count()
+    if tasks or compressed:
+        with mp.get_context("fork").Pool(workers if compressed else min(workers, len(tasks))) as pool:
+            for file_index, table in pool.imap_unordered(aggregate_task, tasks):
+                per_file[file_index].merge(table)
+            for file_index in compressed:
+                table = aggregate_compressed(pool, paths[file_index], workers, chunk_size, window_size, engine)
+                per_file[file_index].merge(table)
+    combined = StationTable(_server.station_names)
+    for table in per_file:
+        combined.merge(table)
+    return combined, per_file
+
+
+def per_file_path(out_dir, path, common, output_format):
+    """
+    Where the results of input `path` go under `out_dir`: its path relative to the
+    inputs' `common` directory, so equally named shards of different directories do
+    not collide.
+    """
+    relative = os.path.relpath(os.path.abspath(path), common)
+    return os.path.join(out_dir, relative + EXTENSIONS[output_format])
+
+
+def process_files(
+    inputs,
+    workers=None,
+    chunk_size=CHUNK_SIZE,
+    window_size=WINDOW_SIZE,
+    engine="python",
+    stations_file=None,
+    max_open=_server.MAX_MAPPED,
+    per_file_dir=None,
+    output_format="lines",
+    order="bytes",
+):
+    """
+    Aggregates the files, directories and glob patterns in `inputs` and writes the
+    combined results to stdout. With `per_file_dir`, each file's results are also
+    written to a file under it, see `per_file_path`.
+    """
+    paths = expand_inputs(inputs)
+    combined, per_file = aggregate_files(paths, workers, chunk_size, window_size, engine, stations_file, max_open)
+    if per_file_dir is not None:
+        common = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+        for path, table in zip(paths, per_file):
+            out_path = per_file_path(per_file_dir, path, common, output_format)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, "w", encoding="utf-8") as out:
+                write_results(table.items(), output_format, order, out)
+    write_results(combined.items(), output_format, order)
+    return paths
@@ -0,0 +1,330 @@
+"""
+NumPy-vectorized window processor, selectable with `jelle.py --engine numpy`.
+
+Not a challenge entry (the challenge is stdlib-only), so ground_truth.py does not
+run this file by itself. It implements the same `process_window(data, table)`
+contract as jelle.py: the worker loop, scheduling and output are shared, only the
+per-window parsing and aggregation are vectorized.
+"""
+import threading
+
+import numpy as np
+
+NEWLINE = ord("\n")
+SEMICOLON = ord(";")
+MINUS = ord("-")
+ZERO = ord("0")
+
+# Station names are at most 100 bytes, i.e. 13 little-endian 8-byte words.
+MAX_NAME_WORDS = 13
+# MASKS[n] keeps the first n bytes of a little-endian 8-byte word.
+MASKS = np.array([(1 << (8 * n)) - 1 for n in range(9)], dtype=np.uint64)
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+# Direct-mapped slots indexed by the top bits of a name hash. With at most 10,000
+# stations only a handful of names share a slot.
+SLOT_BITS = 20
+SLOT_SHIFT = np.uint64(64 - SLOT_BITS)
+
+
+def split_lines(buf):
+    """
+    Returns (line_starts, separators, line_ends) positions for every line in `buf`.
+
+    `line_ends` point at the newline, or one past the last byte for an unterminated
+    last line. Every line holds exactly one ';' followed by one '\\n', so a single
+    scan for both finds them alternating.
+    """
+    marks = np.flatnonzero((buf == NEWLINE) | (buf == SEMICOLON))
+    separators = marks[0::2]
+    line_ends = marks[1::2]
+    if len(line_ends) < len(separators):
+        line_ends = np.append(line_ends, len(buf))
+    line_starts = np.empty_like(line_ends)
+    line_starts[:1] = 0
+    line_starts[1:] = line_ends[:-1] + 1
+    return line_starts, separators, line_ends
+
+
+def parse_temperatures(buf, separators, line_ends):
+    """
+    Parses the `-?d?d.d` temperatures after each separator into integer tenths.
+
+    The last digit and the digit before the '.' are always at fixed offsets from the
+    line end; the tens digit and the sign are picked with masks.
+    """
+    ones = buf[line_ends - 3].astype(np.int64) - ZERO
+    tenths = buf[line_ends - 1].astype(np.int64) - ZERO
+    tens = buf[line_ends - 4].astype(np.int64) - ZERO
+    # For `d.d` the byte before the ones digit is ';', for `-d.d` it is '-'
+    tens[(tens < 0) | (tens > 9)] = 0
+    values = tens * 100 + ones * 10 + tenths
+    negative = buf[separators + 1] == MINUS
+    values[negative] *= -1
+    return values
+
+
+def name_words(buf, line_starts, lengths):
+    """
+    Returns the station names of all lines as an (n, words) matrix of masked
+    little-endian 8-byte words, zero beyond the end of each name.
+
+    `buf` must be padded with 8 zero bytes. A view with a stride of one byte turns
+    every offset into the 8-byte word starting there, so a name of up to 100 bytes
+    takes at most 13 gathers instead of one per byte, and each gather only touches
+    the lines whose name is still long enough.
+    """
+    words = np.ndarray(shape=(len(buf) - 7,), dtype="<u8", buffer=buf, strides=(1,))
+    n_words = (int(lengths.max()) + 7) // 8 if len(lengths) else 0
+    # Column-major, so every word column is contiguous
+    matrix = np.zeros((n_words, len(line_starts)), dtype=np.uint64)
+    live = np.arange(len(line_starts))
+    for column in range(n_words):
+        offset = column * 8
+        if column:
+            live = live[lengths[live] > offset]
+        remaining = np.minimum(lengths[live] - offset, 8)
+        matrix[column, live] = words[line_starts[live] + offset] & MASKS[remaining]
+    return matrix.T
+
+
+def hash_names(matrix, lengths):
+    """
+    Hashes each row of a `name_words` matrix, seeded with the name length.
+    """
+    hashes = lengths.astype(np.uint64)
+    for column in range(matrix.shape[1]):
+        hashes = (hashes ^ matrix[:, column]) * HASH_MULTIPLIER
+    return hashes
+
+
+class StationIds:
+    """
+    Dense station ids that stay stable across all windows of one process.
+
+    Known names are found through a direct-mapped slot table on the top hash bits,
+    with a vectorized `np.searchsorted` over the sorted hashes for the few names that
+    share a slot; only hashes not seen before go through `np.unique`. Every line is
+    then compared word by word against the stored name for its id. A line whose name
+    differs has a hash collision with that station; it is looked up by its exact
+    bytes in `colliding` instead, see `resolve_collisions`.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.sorted_hashes = np.empty(0, dtype=np.uint64)
+        self.sorted_ids = np.empty(0, dtype=np.int64)
+        self.words = np.empty((0, MAX_NAME_WORDS), dtype=np.uint64)
+        self.lengths = np.empty(0, dtype=np.int64)
+        # Station id per slot, -1 when empty
+        self.slots = np.full(1 << SLOT_BITS, -1, dtype=np.int64)
+        # Id per name whose hash was already taken by another name
+        self.colliding = {}
+        # Whether each id passes the name test of `mask_filter`, see `name_mask`
+        self.mask_filter = None
+        self.mask = np.zeros(0, dtype=bool)
+
+    def lookup(self, hashes):
+        """
+        Returns (ids, found) for the given hashes; ids are meaningless where not found.
+        """
+        if not self.names:
+            return np.zeros(len(hashes), dtype=np.int64), np.zeros(len(hashes), dtype=bool)
+        ids = self.slots[hashes >> SLOT_SHIFT]
+        found = self.hashes[ids] == hashes
+        found &= ids >= 0
+        if not found.all():
+            missing = np.flatnonzero(~found)
+            positions = np.searchsorted(self.sorted_hashes, hashes[missing])
+            positions = np.minimum(positions, len(self.sorted_hashes) - 1)
+            ids[missing] = self.sorted_ids[positions]
+            found[missing] = self.sorted_hashes[positions] == hashes[missing]
+        return ids, found
+
+    def register(self, buf, line_starts, lengths, matrix, hashes):
+        """
+        Assigns the next free ids to the distinct unseen names among the given lines.
+        """
+        new_hashes, first = np.unique(hashes, return_index=True)
+        new_ids = len(self.names) + np.arange(len(new_hashes))
+        self.names.extend(
+            bytes(buf[start:start + length])
+            for start, length in zip(line_starts[first].tolist(), lengths[first].tolist())
+        )
+        new_words = np.zeros((len(first), MAX_NAME_WORDS), dtype=np.uint64)
+        new_words[:, :matrix.shape[1]] = matrix[first]
+        self.words = np.concatenate([self.words, new_words])
+        self.lengths = np.concatenate([self.lengths, lengths[first]])
+        self.hashes = np.concatenate([self.hashes, new_hashes])
+
+        # A slot shared by several names keeps the last one; `lookup` notices the hash
+        # mismatch for the others and binary-searches them instead.
+        self.slots[new_hashes >> SLOT_SHIFT] = new_ids
+
+        all_hashes = np.concatenate([self.sorted_hashes, new_hashes])
+        all_ids = np.concatenate([self.sorted_ids, new_ids])
+        order = np.argsort(all_hashes)
+        self.sorted_hashes = all_hashes[order]
+        self.sorted_ids = all_ids[order]
+
+    def name_mask(self, row_filter):
+        """
+        Returns a bool array telling for every id whether its name passes `row_filter`.
+        Only names registered since the last call are tested.
+        """
+        if row_filter is not self.mask_filter:
+            self.mask_filter = row_filter
+            self.mask = np.zeros(0, dtype=bool)
+        if len(self.mask) < len(self.names):
+            new = [row_filter.accepts_name(name) for name in self.names[len(self.mask):]]
+            self.mask = np.concatenate([self.mask, np.array(new, dtype=bool)])
+        return self.mask
+
+    def ids(self, buf, line_starts, separators):
+        """
+        Maps every line's station name to its id, registering unseen names.
+        `buf` must be padded with 8 zero bytes, see `name_words`.
+        """
+        lengths = separators - line_starts
+        matrix = name_words(buf, line_starts, lengths)
+        hashes = hash_names(matrix, lengths)
+        ids, found = self.lookup(hashes)
+        if not found.all():
+            missing = ~found
+            self.register(buf, line_starts[missing], lengths[missing], matrix[missing], hashes[missing])
+            ids, found = self.lookup(hashes)
+
+        same = self.lengths[ids] == lengths
+        live = np.arange(len(ids))
+        for column in range(matrix.shape[1]):
+            if column:
+                live = live[lengths[live] > column * 8]
+            same[live] &= self.words[ids[live], column] == matrix[live, column]
+        if not same.all():
+            mismatched = np.flatnonzero(~same)
+            ids[mismatched] = self.resolve_collisions(
+                buf, line_starts[mismatched], lengths[mismatched], matrix[mismatched], hashes[mismatched]
+            )
+        return ids
+
+    def resolve_collisions(self, buf, line_starts, lengths, matrix, hashes):
+        """
+        Returns the ids of the given lines, whose hashes belong to other names.
+
+        Each name is looked up by its bytes in `colliding` and gets an id of its own
+        the first time. `lookup` never returns those ids, since the hash stays with
+        the name registered first, so every line of a colliding name comes here.
+        """
+        ids = []
+        for row, (start, length) in enumerate(zip(line_starts.tolist(), lengths.tolist())):
+            name = bytes(buf[start:start + length])
+            station = self.colliding.get(name)
+            if station is None:
+                station = self.colliding[name] = len(self.names)
+                self.names.append(name)
+                new_words = np.zeros((1, MAX_NAME_WORDS), dtype=np.uint64)
+                new_words[0, :matrix.shape[1]] = matrix[row]
+                self.words = np.concatenate([self.words, new_words])
+                self.lengths = np.append(self.lengths, length)
+                self.hashes = np.append(self.hashes, hashes[row])
+            ids.append(station)
+        return np.array(ids, dtype=np.int64)
+
+
+class LocalStationIds(threading.local):
+    """
+    The StationIds of the current thread. Forked workers each start from the
+    parent's empty table, and worker threads (see `jelle.py --threads`) each get their
+    own, since registering names is not thread-safe.
+    """
+
+    def __init__(self):
+        self.ids = StationIds()
+
+
+local = LocalStationIds()
+
+
+def filter_rows(ids, values, accepted, row_filter):
+    """
+    Returns the ids and values of the rows whose station id is `accepted` and whose
+    temperature lies in the range of `row_filter`.
+    """
+    keep = accepted[ids]
+    if row_filter.filters_temperatures:
+        keep &= (values >= row_filter.min_tenths) & (values <= row_filter.max_tenths)
+    return ids[keep], values[keep]
+
+
+def process_window(data, table, row_filter=None):
+    """
+    Aggregates all lines of a bytes window into the given StationTable, vectorized.
+
+    Min/max/sum/count are reduced per station id with `np.minimum.at`,
+    `np.maximum.at` and `np.bincount`, and then folded into `table` once per
+    station seen in the window, so the state matches what _scan.process_window
+    produces. With a RowFilter, rows that fail it are masked out before the reduction.
+    """
+    if not data:
+        return
+    station_ids = local.ids
+    padded = np.frombuffer(bytes(data) + bytes(8), dtype=np.uint8)
+    buf = padded[:-8]
+    line_starts, separators, line_ends = split_lines(buf)
+    values = parse_temperatures(buf, separators, line_ends)
+    ids = station_ids.ids(padded, line_starts, separators)
+    if row_filter is not None:
+        ids, values = filter_rows(ids, values, station_ids.name_mask(row_filter), row_filter)
+
+    n = len(station_ids.names)
+    mins = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    maxs = np.full(n, np.iinfo(np.int64).min, dtype=np.int64)
+    np.minimum.at(mins, ids, values)
+    np.maximum.at(maxs, ids, values)
+    counts = np.bincount(ids, minlength=n)
+    sums = np.bincount(ids, weights=values, minlength=n)  # exact: window sums stay far below 2**53
+
+    seen = np.flatnonzero(counts)
+    names = station_ids.names
+    get_id = table.ids.get
+    for station, m_min, m_max, m_sum, m_count in zip(
+        seen.tolist(),
+        mins[seen].tolist(),
+        maxs[seen].tolist(),
+        sums[seen].astype(np.int64).tolist(),
+        counts[seen].tolist(),
+    ):
+        name = names[station]
+        own = get_id(name)
+        if own is None:
+            own = table.add(name)
+        table.update(own, m_min, m_max, m_sum, m_count)
+
+
+def process_columns(ids, temps, table, row_filter=None):
+    """
+    Aggregates a uint16 station-id column and an int16 tenths column (see _cache.py)
+    into a StationTable whose ids are the column's ids.
+    """
+    ids = np.frombuffer(ids, dtype=np.uint16).astype(np.intp)
+    values = np.frombuffer(temps, dtype=np.int16).astype(np.int64)
+    if row_filter is not None:
+        accepted = np.array([row_filter.accepts_name(name) for name in table.names], dtype=bool)
+        ids, values = filter_rows(ids, values, accepted, row_filter)
+    n = len(table)
+    mins = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    maxs = np.full(n, np.iinfo(np.int64).min, dtype=np.int64)
+    np.minimum.at(mins, ids, values)
+    np.maximum.at(maxs, ids, values)
+    counts = np.bincount(ids, minlength=n)
+    sums = np.bincount(ids, weights=values, minlength=n)  # exact: chunk sums stay far below 2**53
+
+    seen = np.flatnonzero(counts)
+    for station, m_min, m_max, m_sum, m_count in zip(
+        seen.tolist(),
+        mins[seen].tolist(),
+        maxs[seen].tolist(),
+        sums[seen].astype(np.int64).tolist(),
+        counts[seen].tolist(),
+    ):
+        table.update(station, m_min, m_max, m_sum, m_count)
@@ -0,0 +1,114 @@
+"""
+Result formatting for the entries (`--format`, `--sort`).
+
+The whole result is rendered into one string and written with a single call, instead
+of one `print` (and, on a terminal, one flush) per station. Formats:
+
+    lines   Abha=-31.1/18.0/66.5           one station per line (default)
+    1brc    {Abha=-31.1/18.0/66.5, ...}    the original challenge's single line
+    csv     station,min,mean,max,count     with a header row
+    jsonl   {"station": "Abha", "min": -31.1, "mean": 18.0, "max": 66.5, "count": 4}
+
+Stations are sorted by their UTF-8 bytes (which is code point order, and what the
+ground truth uses), or with `locale` by the collation of the current LC_COLLATE.
+Temperatures are formatted from exact integer tenths; only the mean is divided.
+"""
+import csv
+import io
+import json
+import locale
+import sys
+from operator import itemgetter
+
+FORMATS = ("lines", "1brc", "csv", "jsonl")
+ORDERS = ("bytes", "locale")
+
+
+def format_tenths(value):
+    """
+    Formats integer tenths with one decimal, without going through float.
+    """
+    if value < 0:
+        return f"-{-value // 10}.{-value % 10}"
+    return f"{value // 10}.{value % 10}"
+
+
+def format_mean(total, count):
+    """
+    Formats the mean of `count` measurements summing to `total` tenths.
+
+    The sum is an exact integer, so the single division here is the only rounding step.
+    It rounds exactly like ground_truth.py does, so ties print identically.
+    """
+    return f"{total / count / 10:.1f}"
+
+
+def sorted_stations(items, order="bytes"):
+    """
+    Returns (name, min, mean, max, count, extra) for every (name bytes, [min, max,
+    sum, count]) in `items`, with decoded names and formatted temperatures, sorted by
+    `order`. `extra` is a dict of further preformatted columns, taken from an
+    optional fifth value of the items (see `HistogramTable.summary_items`).
+    """
+    rows = [
+        (
+            name.decode(), format_tenths(min_val), format_mean(total, count), format_tenths(max_val), count,
+            extra[0] if extra else {},
+        )
+        for name, (min_val, max_val, total, count, *extra) in sorted(items, key=itemgetter(0))
+    ]
+    if order == "locale":
+        locale.setlocale(locale.LC_COLLATE, "")
+        rows.sort(key=lambda row: locale.strxfrm(row[0]))
+    elif order != "bytes":
+        raise ValueError(f"unknown sort order {order!r}, expected one of {', '.join(ORDERS)}")
+    return rows
+
+
+def format_extra(extra, separator):
+    return "".join([f"{separator}{key}={value}" for key, value in extra.items()])
+
+
+def format_results(items, output_format="lines", order="bytes"):
+    """
+    Renders (name bytes, [min, max, sum, count]) pairs, e.g. `StationTable.items()`,
+    as one string in `output_format`, ending with a newline unless it is empty.
+    Extra columns follow min/mean/max as ` key=value` in the text formats, and as
+    further columns or keys in CSV and JSON Lines.
+    """
+    rows = sorted_stations(items, order)
+    if output_format == "lines":
+        return "".join([
+            f"{name}={min_val}/{mean}/{max_val}{format_extra(extra, ' ')}\n"
+            for name, min_val, mean, max_val, _, extra in rows
+        ])
+    if output_format == "1brc":
+        return "{" + ", ".join([
+            f"{name}={min_val}/{mean}/{max_val}{format_extra(extra, ' ')}"
+            for name, min_val, mean, max_val, _, extra in rows
+        ]) + "}\n"
+    if output_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(("station", "min", "mean", "max", "count", *(rows[0][5] if rows else ())))
+        writer.writerows([(*row[:5], *row[5].values()) for row in rows])
+        return buffer.getvalue()
+    if output_format == "jsonl":
+        # The temperatures are already valid JSON numbers with exactly one decimal
+        return "".join([
+            f'{{"station": {json.dumps(name, ensure_ascii=False)}, "min": {min_val}, "mean": {mean}, '
+            f'"max": {max_val}, "count": {count}'
+            + "".join([f', "{key}": {value}' for key, value in extra.items()])
+            + "}\n"
+            for name, min_val, mean, max_val, count, extra in rows
+        ])
+    raise ValueError(f"unknown output format {output_format!r}, expected one of {', '.join(FORMATS)}")
+
+
+def write_results(items, output_format="lines", order="bytes", stream=None):
+    """
+    Writes the rendered results to `stream` (default stdout) in one call.
+    """
+    stream = stream or sys.stdout
+    stream.write(format_results(items, output_format, order))
+    stream.flush()
@@ -0,0 +1,130 @@
+"""
+pread-based reader for jelle.py (`--reader pread`), an alternative to mapping the file.
+
+A mapping needs address space for the whole file, and on network filesystems every
+page fault is a round trip. This reader instead fills two preallocated buffers of
+`buffer_size` bytes with `os.preadv`, alternately: while the worker parses one, a
+background thread reads the next one into the other. Reads start at page-aligned
+offsets and are whole buffers, so the kernel sees large sequential requests.
+
+Chunks are nominal byte ranges that nobody aligned up front (see `nominal_chunks`).
+The reader aligns them as it reads, following `_chunker.align_range`: it skips the
+line that started before the chunk and reads past the chunk's end until the last line
+that started inside it is complete. Whole lines are then handed to the window
+processor in windows of `window_size`, exactly as `_scan.process_chunk` does.
+"""
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from _chunker import iter_windows
+
+# Default size of each of the two read buffers
+READ_BUFFER = 16 * 1024 * 1024
+
+PAGE_MASK = ~(mmap.PAGESIZE - 1)
+
+
+def nominal_chunks(size, chunk_size):
+    """
+    Returns the unaligned (start, end) ranges of `chunk_size` bytes covering a file
+    of `size` bytes; `PreadReader.process_chunk` aligns them to lines.
+    """
+    return [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+
+class PreadReader:
+    """
+    Reads chunks of `file_name` through two buffers of `buffer_size` bytes.
+
+    The descriptor, the buffers and the prefetching thread are created on first use,
+    by every thread that scans chunks, so the reader can be created in the parent and
+    handed to forked or spawned workers, or shared by worker threads.
+    """
+
+    def __init__(self, file_name, buffer_size=READ_BUFFER):
+        self.file_name = file_name
+        self.buffer_size = max(mmap.PAGESIZE, buffer_size & PAGE_MASK)
+        self.local = threading.local()
+
+    def __getstate__(self):
+        return {"file_name": self.file_name, "buffer_size": self.buffer_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def open(self):
+        """
+        Returns this thread's (fd, buffers, views, prefetcher).
+        """
+        local = self.local
+        if not hasattr(local, "fd"):
+            local.fd = os.open(self.file_name, os.O_RDONLY)
+            local.buffers = [bytearray(self.buffer_size), bytearray(self.buffer_size)]
+            local.views = [memoryview(buffer) for buffer in local.buffers]
+            local.prefetcher = ThreadPoolExecutor(1, thread_name_prefix="pread")
+        return local.fd, local.buffers, local.views, local.prefetcher
+
+    def process_chunk(self, start, end, table, window_size, window_processor):
+        """
+        Aggregates the lines that start in the nominal range [start, end) into `table`.
+        """
+        fd, buffers, views, prefetcher = self.open()
+        # Reading from the byte before the chunk tells whether a line starts at `start`
+        skip_to = start - 1 if start > 0 else None
+        pos = max(start - 1, 0) & PAGE_MASK
+        current = 0
+        future = prefetcher.submit(os.preadv, fd, [buffers[current]], pos)
+        carry = b""
+        while True:
+            n = future.result()
+            data, view = buffers[current], views[current]
+            block_start = pos
+            pos += n
+            if n == 0:
+                # End of file: the last line had no newline
+                if carry and skip_to is None:
+                    window_processor(carry, table)
+                return
+
+            lo = 0
+            if skip_to is not None:
+                newline = data.find(b"\n", skip_to - block_start, n)
+                if newline == -1:
+                    # Still inside the line that began in the previous chunk
+                    skip_to = pos
+                    current ^= 1
+                    future = prefetcher.submit(os.preadv, fd, [buffers[current]], pos)
+                    continue
+                lo = newline + 1
+                skip_to = None
+                if block_start + lo >= end:
+                    return  # no line starts in the chunk
+
+            # The newline that ends the last line starting before `end`, if it is here
+            stop, last = -1, False
+            if pos >= end:
+                stop = data.find(b"\n", max(end - 1 - block_start, lo), n)
+                last = stop != -1
+            if not last:
+                stop = data.rfind(b"\n", lo, n)
+                current ^= 1
+                future = prefetcher.submit(os.preadv, fd, [buffers[current]], pos)
+                if stop == -1:
+                    carry += view[lo:n]
+                    continue
+
+            # The partial line carried over from the previous buffer, completed
+            first = data.find(b"\n", lo, stop)
+            if first == -1:
+                first = stop
+            head = carry + view[lo:first]
+            if head:
+                window_processor(head, table)
+            for window_start, window_end in iter_windows(data, first + 1, stop, window_size):
+                window_processor(view[window_start:window_end].tobytes(), table)
+            if last:
+                return
+            carry = view[stop + 1:n].tobytes()
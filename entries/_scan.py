@@ -0,0 +1,266 @@
+"""
+Scanning of measurements text, shared by jelle.py and its helper modules.
+
+Holds the temperature table, the window processors that aggregate a window of whole
+lines into a StationTable, and `process_chunk`, which walks a chunk of a mapping
+window by window. Everything takes the mapping or buffer to read as an argument, so
+the helpers (the server, the index, the cache, multi-file and compressed input) scan
+their own mappings without touching jelle.py's module state.
+"""
+import mmap
+import time
+from functools import partial
+
+from _chunker import iter_windows
+
+# Default chunk size handed out to workers. Many small chunks instead of one per CPU
+# let fast workers keep pulling work while a slow one finishes its current chunk.
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Default size of the window a worker copies out of the mmap at a time. Peak memory per
+# worker is bounded by this, independent of the chunk and file size.
+WINDOW_SIZE = 1024 * 1024
+
+# Available window processors, see `load_engine`.
+ENGINES = ("python", "numpy")
+
+# Per-process phase timings of the instrumented window processors, see _instrument.py.
+phase_times = {}
+
+
+def parse_tenths(text: bytes) -> int:
+    """
+    Parses a temperature in the fixed `-?d?d.d` format into integer tenths.
+    Temperatures lie in [-99.9, 99.9], so everything is aggregated as integers.
+
+    Branches on length and sign instead of looping over characters; 48 is ord('0'),
+    so 528 == 48 * 11 and 5328 == 48 * 111 strip the ASCII offsets in one subtraction.
+    """
+    n = len(text)
+    if n == 3:  # d.d
+        return text[0] * 10 + text[2] - 528
+    if n == 4:
+        if text[0] == 45:  # -d.d
+            return 528 - text[1] * 10 - text[3]
+        return text[0] * 100 + text[1] * 10 + text[3] - 5328  # dd.d
+    return 5328 - text[1] * 100 - text[2] * 10 - text[4]  # -dd.d
+
+
+# Every temperature the format allows, mapped to its integer tenths. In the hot loop a
+# single dict lookup is cheaper than calling even a specialised parser, and no float
+# is ever created.
+TENTHS = {
+    text: parse_tenths(text)
+    for text in (
+        f"{sign}{whole}.{frac}".encode()
+        for sign in ("", "-")
+        for whole in range(100)
+        for frac in range(10)
+    )
+}
+
+
+def open_mapping(file_name):
+    """
+    Memory-maps the entire file `file_name` in read-only mode. Pages are only read in
+    when touched, so mapping a large file is cheap.
+    """
+    with open(file_name, 'rb') as f:
+        return mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
+
+
+def process_chunk(mapping, start, end, table, window_size=WINDOW_SIZE, window_processor=None, io_policy=None):
+    """
+    Processes a single chunk of `mapping` (from start to end byte offset): a mmap, or
+    any buffer with find/rfind and slicing, such as decompressed bytes.
+
+    The chunk is walked window by window, so only `window_size` bytes (and the lines
+    split from them) are copied out of the mapping at any time. Each window is handed to
+    `window_processor` (default: `process_window`, see `load_engine`). An `io_policy`
+    advises the kernel on the chunk, the window ahead and the window just parsed,
+    see _io_policy.py.
+
+    Updates the aggregations of the given StationTable in place:
+    - min temperature
+    - max temperature
+    - sum of temperatures
+    - count of measurements
+    """
+    window_processor = window_processor or process_window
+    if io_policy is not None:
+        io_policy.chunk(mapping, start, end, window_size)
+    for window_start, window_end in iter_windows(mapping, start, end, window_size):
+        if io_policy is not None:
+            io_policy.ahead(mapping, window_end + 1, min(window_end + 1 + window_size, end))
+        window_processor(mapping[window_start:window_end], table)
+        if io_policy is not None:
+            io_policy.behind(mapping, window_start, window_end)
+
+
+def process_window(data, table):
+    """
+    Aggregates all lines of a bytes window into the given StationTable.
+
+    Each row costs one dict lookup for its station id; the aggregation lists are
+    indexed by that id, so nothing is allocated for a station already seen.
+    """
+    tenths = TENTHS
+    get_id = table.ids.get
+    mins, maxs, sums, counts = table.mins, table.maxs, table.sums, table.counts
+
+    # Split data into lines
+    for line in data.splitlines():
+        city, measurement = line.split(b";")
+        measurement = tenths[measurement]
+
+        # Retrieve the id of this city
+        station = get_id(city)
+        if station is None:
+            station = table.add(city)
+        # Update the aggregation values
+        if measurement < mins[station]:
+            mins[station] = measurement
+        if measurement > maxs[station]:
+            maxs[station] = measurement
+        sums[station] += measurement
+        counts[station] += 1
+
+
+def process_window_filtered(data, table, row_filter):
+    """
+    Like `process_window`, but only aggregates the rows that pass a RowFilter.
+
+    A row is rejected right after locating ';': the name test is remembered per
+    name, so a rejected station costs one dict lookup and its temperature is never
+    parsed. The temperature range is applied by the lookup in the restricted tenths
+    table itself.
+    """
+    tenths = row_filter.restrict(TENTHS).get
+    decided = row_filter.decided
+    get_id = table.ids.get
+    mins, maxs, sums, counts = table.mins, table.maxs, table.sums, table.counts
+
+    for line in data.splitlines():
+        city, measurement = line.split(b";")
+        accepted = decided.get(city)
+        if accepted is None:
+            accepted = decided[city] = row_filter.accepts_name(city)
+        if not accepted:
+            continue
+        measurement = tenths(measurement)
+        if measurement is None:
+            continue
+
+        station = get_id(city)
+        if station is None:
+            station = table.add(city)
+        if measurement < mins[station]:
+            mins[station] = measurement
+        if measurement > maxs[station]:
+            maxs[station] = measurement
+        sums[station] += measurement
+        counts[station] += 1
+
+
+def process_window_histogram(data, table):
+    """
+    Like `process_window`, but also counts each row in its station's histogram
+    bucket (see _histogram.py). Needs a HistogramTable.
+    """
+    tenths = TENTHS
+    get_id = table.ids.get
+    mins, maxs, sums, counts = table.mins, table.maxs, table.sums, table.counts
+    buckets, offsets = table.buckets, table.offsets
+
+    for line in data.splitlines():
+        city, measurement = line.split(b";")
+        measurement = tenths[measurement]
+
+        station = get_id(city)
+        if station is None:
+            station = table.add(city)
+        if measurement < mins[station]:
+            mins[station] = measurement
+        if measurement > maxs[station]:
+            maxs[station] = measurement
+        sums[station] += measurement
+        counts[station] += 1
+        try:
+            buckets[offsets[station] + measurement] += 1
+        except TypeError:
+            # The station's first row: its offset is still None
+            table.allocate(station)
+            buckets[offsets[station] + measurement] += 1
+
+
+def process_window_instrumented(data, table):
+    """
+    Does what `process_window` does in three timed passes (splitting lines, parsing,
+    aggregating) and adds their times to `phase_times`. Slower than the fused loop,
+    so it is only used with --instrument.
+    """
+    t0 = time.perf_counter()
+    lines = data.splitlines()
+    t1 = time.perf_counter()
+    tenths = TENTHS
+    parsed = []
+    for line in lines:
+        city, measurement = line.split(b";")
+        parsed.append((city, tenths[measurement]))
+    t2 = time.perf_counter()
+
+    get_id = table.ids.get
+    mins, maxs, sums, counts = table.mins, table.maxs, table.sums, table.counts
+    for city, measurement in parsed:
+        station = get_id(city)
+        if station is None:
+            station = table.add(city)
+        if measurement < mins[station]:
+            mins[station] = measurement
+        if measurement > maxs[station]:
+            maxs[station] = measurement
+        sums[station] += measurement
+        counts[station] += 1
+    t3 = time.perf_counter()
+
+    phase_times["split"] = phase_times.get("split", 0.0) + t1 - t0
+    phase_times["parse"] = phase_times.get("parse", 0.0) + t2 - t1
+    phase_times["aggregate"] = phase_times.get("aggregate", 0.0) + t3 - t2
+
+
+def load_engine(engine, columns=False, row_filter=None, instrument=False, histogram=False):
+    """
+    Returns the window processor for the given engine name.
+
+    "python" is the stdlib-only `process_window`. "numpy" is the vectorized one from
+    _numpy_engine.py, imported only when asked for so jelle.py stays stdlib-only.
+
+    With `columns`, returns the engine's processor for binary cache columns instead
+    (see `_cache.process_rows`). With a `row_filter`, the processor only aggregates
+    the rows that pass it. With `instrument`, the processor records its time in
+    `phase_times`, broken down by phase for the unfiltered python window processor.
+    With `histogram`, the processor also fills the buckets of a HistogramTable; only
+    the unfiltered python window processor can.
+    """
+    if histogram:
+        if engine != "python" or columns or row_filter is not None:
+            raise ValueError("histograms are only kept by the unfiltered python engine on the text file")
+        processor = process_window_histogram
+    elif instrument and engine == "python" and not columns and row_filter is None:
+        return process_window_instrumented
+    elif engine == "numpy":
+        import _numpy_engine
+        processor = _numpy_engine.process_columns if columns else _numpy_engine.process_window
+    elif columns:
+        import _cache
+        processor = _cache.process_columns
+    elif row_filter is not None:
+        processor = process_window_filtered
+    else:
+        processor = process_window
+    if row_filter is not None:
+        processor = partial(processor, row_filter=row_filter)
+    if instrument:
+        from _instrument import timed
+        processor = timed(processor, phase_times)
+    return processor
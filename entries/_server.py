@@ -0,0 +1,321 @@
+"""
+Persistent worker-pool server for jelle.py (`jelle.py --serve ADDRESS`).
+
+Keeps a warm pool of forked workers and an LRU of memory-mapped files, so repeated
+queries skip interpreter startup, process spawning, mmap setup and (for files that
+stay mapped) cold page faults. Clients send one JSON request per line and get one
+JSON response per line back:
+
+    {"path": "/data/measurements.txt"}
+    {"path": "/data/measurements.txt", "ranges": [[0, 1048576], [4194304, 8388608]]}
+    {"path": "/data/measurements.txt", "format": "jsonl", "sort": "locale"}
+    -> {"ok": true, "output": "Abha=-31.1/18.0/66.5\\n...\\n"}
+    -> {"ok": false, "error": "..."}
+
+With `"partial": true`, the response holds the unformatted table instead, as the
+names and columns of its stations with measurements (see `table_to_partial`), for a
+coordinator to merge with other servers' partials (see _distributed.py):
+
+    {"path": "/data/measurements.txt", "ranges": [[0, 67108864]], "partial": true}
+    -> {"ok": true, "partial": {"names": ["Abha", ...], "mins": [...], "maxs": [...],
+        "sums": [...], "counts": [...]}}
+
+Byte ranges are aligned to whole lines with `_chunker.align_range`. ADDRESS is either
+`HOST:PORT` for TCP or a filesystem path for a Unix socket.
+
+Any client that reaches the socket can send requests, so the server only reads files
+under its `roots` (the directories given to `serve`), only runs the known engines,
+and never echoes what it failed to parse: an error response names the problem with
+the request or says the file could not be parsed, and the details go to the
+server's stderr.
+"""
+import json
+import multiprocessing as mp
+import os
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+
+from _chunker import align_range, split_range
+from _output import FORMATS, ORDERS, format_results
+from _scan import CHUNK_SIZE, ENGINES, WINDOW_SIZE, load_engine, open_mapping, process_chunk
+from _stations import StationTable, load_station_names
+
+# Default number of files each process keeps mapped.
+MAX_MAPPED = 8
+
+# Per-process LRU of path -> ((size, mtime_ns), mmap). Forked pool workers start
+# from the parent's entries and then keep their own.
+mapped = OrderedDict()
+max_mapped = MAX_MAPPED
+
+# Station names preloaded into every table, set by `serve` before the pool forks.
+station_names = ()
+
+# Real paths of the directories whose files the server reads, set by `serve`.
+roots = ()
+
+# Request threads share the parent's LRU, and a mapping must not be evicted (and
+# closed) while another thread is still planning the chunks of its file.
+planning_lock = threading.Lock()
+
+
+def mapped_file(path):
+    """
+    Returns a read-only mmap of `path`, reusing the mapping while the file's size
+    and mtime are unchanged and evicting the least recently used beyond `max_mapped`.
+    """
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime_ns)
+    entry = mapped.get(path)
+    if entry is not None:
+        if entry[0] == key:
+            mapped.move_to_end(path)
+            return entry[1]
+        del mapped[path]
+        entry[1].close()
+
+    mapping = open_mapping(path)
+    mapped[path] = (key, mapping)
+    while len(mapped) > max_mapped:
+        _, (_, oldest) = mapped.popitem(last=False)
+        oldest.close()
+    return mapping
+
+
+def aggregate_chunk(task):
+    """
+    Aggregates one chunk of a file into a fresh StationTable. Runs in a pool worker.
+    """
+    path, start, end, window_size, engine = task
+    table = StationTable(station_names)
+    process_chunk(mapped_file(path), start, end, table, window_size, load_engine(engine))
+    return table
+
+
+def aggregate(pool, path, ranges=None, chunk_size=CHUNK_SIZE, window_size=WINDOW_SIZE, engine="python"):
+    """
+    Aggregates the whole file, or the given byte ranges of it, on the pool.
+    Returns the merged StationTable.
+    """
+    path = os.path.abspath(path)
+    tasks = []
+    with planning_lock:
+        mapping = mapped_file(path)
+        for start, end in ranges or [(0, len(mapping))]:
+            start, end = align_range(mapping, start, end)
+            for chunk_start, chunk_end in split_range(mapping, start, end, chunk_size):
+                tasks.append((path, chunk_start, chunk_end, window_size, engine))
+
+    result = StationTable(station_names)
+    for table in pool.imap_unordered(aggregate_chunk, tasks):
+        result.merge(table)
+    return result
+
+
+class RequestError(ValueError):
+    """
+    A request the server refuses; its message is sent back to the client.
+    """
+
+
+def check_request(request):
+    """
+    Returns the request's path, resolved, after checking that it lies under one of
+    the `roots` and that the engine, format and order are known. Raises RequestError
+    otherwise.
+    """
+    if not isinstance(request, dict) or not isinstance(request.get("path"), str):
+        raise RequestError("a request is a JSON object with a \"path\"")
+    path = os.path.realpath(request["path"])
+    if not any(os.path.commonpath([root, path]) == root for root in roots):
+        raise RequestError(f"{request['path']} is outside the directories this server reads")
+    for key, known in (("engine", ENGINES), ("format", FORMATS), ("sort", ORDERS)):
+        if key in request and request[key] not in known:
+            raise RequestError(f"unknown {key} {request[key]!r}, expected one of {', '.join(known)}")
+    return path
+
+
+def table_to_partial(table):
+    """
+    Returns the stations of `table` that have measurements as a JSON-serializable
+    dict of names and integer columns, the layout of a checkpoint.
+    """
+    partial = {"names": [], "mins": [], "maxs": [], "sums": [], "counts": []}
+    for name, (m_min, m_max, m_sum, m_count) in table.items():
+        partial["names"].append(name.decode())
+        partial["mins"].append(m_min)
+        partial["maxs"].append(m_max)
+        partial["sums"].append(m_sum)
+        partial["counts"].append(m_count)
+    return partial
+
+
+def merge_partial(table, partial):
+    """
+    Merges a partial from `table_to_partial` into `table`.
+    """
+    names = [name.encode() for name in partial["names"]]
+    table.merge_columns(names, 0, partial["mins"], partial["maxs"], partial["sums"], partial["counts"])
+
+
+def parse_address(address):
+    """
+    Returns (family, address) for `HOST:PORT` or a Unix socket path.
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answers JSON-lines requests on one connection until the client closes it.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            path = "the request"
+            try:
+                request = json.loads(line)
+                path = check_request(request)
+                table = aggregate(
+                    self.server.pool,
+                    path,
+                    request.get("ranges"),
+                    self.server.chunk_size,
+                    self.server.window_size,
+                    request.get("engine", self.server.engine),
+                )
+                if request.get("partial"):
+                    response = {"ok": True, "partial": table_to_partial(table)}
+                else:
+                    output = format_results(
+                        table.items(), request.get("format", "lines"), request.get("sort", "bytes")
+                    )
+                    response = {"ok": True, "output": output}
+            except (RequestError, json.JSONDecodeError) as e:
+                response = {"ok": False, "error": f"bad request: {e}"}
+            except OSError as e:
+                response = {"ok": False, "error": f"cannot read {path}: {e.strerror}"}
+            except Exception:
+                # The message may quote the file's contents, so it stays on this side
+                traceback.print_exc()
+                response = {"ok": False, "error": f"could not parse {path}"}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(
+    address,
+    workers=None,
+    chunk_size=CHUNK_SIZE,
+    window_size=WINDOW_SIZE,
+    engine="python",
+    stations_file=None,
+    max_open=MAX_MAPPED,
+    root_dirs=(),
+):
+    """
+    Runs the server until interrupted. The pool is forked once up front. Only files
+    under `root_dirs` (default: the current directory) are read.
+    """
+    global station_names, max_mapped, roots
+    station_names = load_station_names(stations_file) if stations_file else ()
+    max_mapped = max_open
+    roots = tuple(os.path.realpath(root) for root in root_dirs or (os.curdir,))
+    load_engine(engine)  # fail early if the engine cannot be imported
+
+    family, bind_address = parse_address(address)
+    server_class = ThreadingTCPServer if family == socket.AF_INET else ThreadingUnixServer
+    if family == socket.AF_UNIX and os.path.exists(bind_address):
+        os.unlink(bind_address)
+
+    workers = workers or mp.cpu_count()
+    with mp.get_context("fork").Pool(workers) as pool, server_class(bind_address, RequestHandler) as server:
+        server.pool = pool
+        server.chunk_size = chunk_size
+        server.window_size = window_size
+        server.engine = engine
+        print(f"serving on {address} with {workers} workers", flush=True)
+        print(f"reading files under {', '.join(roots)}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if family == socket.AF_UNIX:
+                os.unlink(bind_address)
+
+
+class Connection:
+    """
+    A client connection to a running server, for any number of requests in a row.
+    With a `timeout` in seconds, connecting and every response must arrive in time.
+    """
+
+    def __init__(self, address, timeout=None):
+        family, connect_address = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            self.sock.settimeout(timeout)
+            self.sock.connect(connect_address)
+        except OSError:
+            self.sock.close()
+            raise
+        self.stream = self.sock.makefile("rwb")
+
+    def send(self, message):
+        """
+        Sends one request and returns the response, raising RuntimeError if the
+        server answered with an error and ConnectionError if it hung up.
+        """
+        self.stream.write(json.dumps(message).encode() + b"\n")
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("the server closed the connection")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def request(address, path, ranges=None, engine=None, output_format=None, order=None):
+    """
+    Sends one aggregation request to a running server and returns its output text.
+    """
+    message = {"path": os.path.abspath(path)}
+    if ranges:
+        message["ranges"] = ranges
+    if engine:
+        message["engine"] = engine
+    if output_format:
+        message["format"] = output_format
+    if order:
+        message["sort"] = order
+    with Connection(address) as connection:
+        return connection.send(message)["output"]
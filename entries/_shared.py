@@ -0,0 +1,161 @@
+"""
+Shared-memory transport for the per-worker StationTables of jelle.py.
+
+The parent allocates one `multiprocessing.shared_memory` block with a fixed-width
+slot per worker. A worker writes its table straight into its slot when it is done,
+and the parent reduces all slots in place after joining, so no table is pickled and no
+Queue feeder thread is involved.
+
+Slot layout (all integers little-endian int64):
+    header     n_stations, names_len, stats_len
+    stats      JSON-encoded worker stats, STATS_SIZE bytes
+    aggregates mins, maxs, sums, counts; `capacity` entries each
+    names      b"\\n"-joined names the worker interned beyond the preloaded ones
+    buckets    with `histograms`, BUCKETS uint32 per station, only written for the
+               stations with measurements (see _histogram.py)
+
+Worker threads (`jelle.py --threads`) share the parent's memory, so LocalResults
+just keeps their tables and merges them as they are.
+"""
+import json
+import struct
+import time
+from array import array
+from multiprocessing import shared_memory
+
+from _histogram import BUCKET_BYTES, BUCKETS
+from _stations import MIN_TENTHS
+
+# At most 10,000 distinct stations of at most 100 bytes each (challenge rules).
+MAX_STATIONS = 10_000
+MAX_NAME_BYTES = 100
+
+HEADER = struct.Struct("<qqq")
+STATS_SIZE = 4096
+PAGE_SIZE = 4096
+
+
+class SharedResults:
+    """
+    One shared memory block holding a result slot per worker.
+
+    Created in the parent before the workers are forked; workers inherit the
+    mapping and call `write`, the parent calls `merge_into` after joining them and
+    finally `unlink`.
+    """
+
+    def __init__(self, workers, station_names=(), histograms=False):
+        self.workers = workers
+        self.station_names = list(station_names)
+        self.histograms = histograms
+        # Preloaded stations plus whatever a worker may still discover on its own
+        self.capacity = len(self.station_names) + MAX_STATIONS
+        self.names_size = MAX_STATIONS * (MAX_NAME_BYTES + 1)
+        self.aggregates_offset = HEADER.size + STATS_SIZE
+        self.names_offset = self.aggregates_offset + 4 * 8 * self.capacity
+        self.buckets_offset = self.names_offset + self.names_size
+        # Only the buckets of stations a worker found are ever written, so the pages
+        # reserved for the others are never allocated
+        buckets_size = self.capacity * BUCKET_BYTES if histograms else 0
+        # Page-aligned slots, so two workers never write to the same page
+        self.slot_size = -(-(self.buckets_offset + buckets_size) // PAGE_SIZE) * PAGE_SIZE
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slot_size * workers)
+
+    def slot(self, worker_id):
+        start = worker_id * self.slot_size
+        return self.shm.buf[start:start + self.slot_size]
+
+    def write(self, worker_id, table, stats):
+        """
+        Writes a worker's table and stats into its slot. Runs in the worker.
+        The time it takes to write the table is added to the stats as "serialize".
+        """
+        t0 = time.perf_counter()
+        n = len(table)
+        if n > self.capacity:
+            raise ValueError(f"worker {worker_id} found {n} stations, more than the {self.capacity} slots reserved")
+        names = b"\n".join(table.names[table.preloaded:])
+        if len(names) > self.names_size:
+            raise ValueError(f"worker {worker_id} station names exceed {self.names_size} bytes")
+
+        slot = self.slot(worker_id)
+        aggregates = slot[self.aggregates_offset:self.names_offset].cast("q")
+        for column, values in enumerate((table.mins, table.maxs, table.sums, table.counts)):
+            offset = column * self.capacity
+            aggregates[offset:offset + n] = array("q", values)
+        slot[self.names_offset:self.names_offset + len(names)] = names
+        aggregates.release()
+        if self.histograms:
+            buckets = memoryview(table.buckets).cast("B")
+            for station, offset in enumerate(table.offsets):
+                if offset is not None:
+                    start = 4 * (offset + MIN_TENTHS)
+                    position = self.buckets_offset + station * BUCKET_BYTES
+                    slot[position:position + BUCKET_BYTES] = buckets[start:start + BUCKET_BYTES]
+            buckets.release()
+
+        stats = dict(stats, serialize=time.perf_counter() - t0)
+        stats_json = json.dumps(stats).encode()
+        if len(stats_json) > STATS_SIZE:
+            slot.release()
+            raise ValueError(f"worker {worker_id} stats exceed {STATS_SIZE} bytes")
+        HEADER.pack_into(slot, 0, n, len(names), len(stats_json))
+        slot[HEADER.size:HEADER.size + len(stats_json)] = stats_json
+        slot.release()
+
+    def merge_into(self, worker_id, table):
+        """
+        Reduces a worker's slot into `table` and returns the worker's stats.
+        Runs in the parent after joining.
+
+        The columns are reduced straight from the slot, preloaded ids element-wise,
+        without building an intermediate table per worker.
+        """
+        slot = self.slot(worker_id)
+        n, names_len, stats_len = HEADER.unpack_from(slot, 0)
+        stats = json.loads(bytes(slot[HEADER.size:HEADER.size + stats_len]))
+        names = self.station_names
+        if names_len:
+            names = names + bytes(slot[self.names_offset:self.names_offset + names_len]).split(b"\n")
+        if len(names) != n:
+            raise ValueError(f"worker {worker_id} slot holds {n} stations but {len(names)} names")
+
+        aggregates = slot[self.aggregates_offset:self.names_offset].cast("q")
+        columns = [aggregates[column * self.capacity:column * self.capacity + n].tolist() for column in range(4)]
+        table.merge_columns(names, len(self.station_names), *columns)
+        aggregates.release()
+        if self.histograms:
+            # Station order, see `write`
+            buckets = slot[self.buckets_offset:self.buckets_offset + n * BUCKET_BYTES].cast("I")
+            offsets = range(-MIN_TENTHS, n * BUCKETS - MIN_TENTHS, BUCKETS)
+            table.merge_buckets(names, len(self.station_names), columns[3], buckets, offsets)
+            buckets.release()
+        slot.release()
+        return stats
+
+    def unlink(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class LocalResults:
+    """
+    The counterpart of SharedResults for worker threads: `write` keeps a worker's
+    table and stats, and `merge_into` merges the table with `StationTable.merge`.
+    """
+
+    def __init__(self, workers, histograms=False):
+        self.workers = workers
+        self.histograms = histograms
+        self.slots = [None] * workers
+
+    def write(self, worker_id, table, stats):
+        self.slots[worker_id] = (table, stats)
+
+    def merge_into(self, worker_id, table):
+        worker_table, stats = self.slots[worker_id]
+        table.merge(worker_table)
+        return stats
+
+    def unlink(self):
+        self.slots = [None] * self.workers
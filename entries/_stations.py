@@ -0,0 +1,189 @@
+"""
+Station-name interning for jelle.py.
+
+Each distinct station name gets a dense integer id, and its [min, max, sum, count]
+state lives in four flat id-indexed lists instead of one list per station in a dict.
+Tables preloaded from the same name list give every worker the same ids, so merging
+them is an element-wise reduction.
+"""
+from array import array
+
+# Temperatures are aggregated as integer tenths in [-99.9, 99.9].
+MIN_TENTHS = -999
+MAX_TENTHS = 999
+
+
+def load_station_names(file_name):
+    """
+    Reads the distinct station names from a `weather_stations.csv`-style file
+    (`name;latitude` per line, `#` comment lines), as UTF-8 bytes in file order.
+    """
+    names = {}
+    with open(file_name, "rb") as f:
+        for line in f:
+            if line.startswith(b"#"):
+                continue
+            name = line.split(b";", 1)[0].rstrip(b"\r\n")
+            if name:
+                names[name] = None
+    return list(names)
+
+
+class StationTable:
+    """
+    Interned station names with their aggregations in flat id-indexed lists.
+
+    The hot loop binds `ids`, `mins`, `maxs`, `sums` and `counts` to locals and only
+    calls `add` for a name it has not seen before. Plain lists are used while
+    aggregating since CPython indexes them faster than `array`; they are packed into
+    `array('q')` when the table is pickled.
+    """
+
+    def __init__(self, names=()):
+        self.ids = {}
+        self.names = []
+        self.mins = []
+        self.maxs = []
+        self.sums = []
+        self.counts = []
+        for name in names:
+            self.add(name)
+        # Ids below this are the same in every table built from the same names
+        self.preloaded = len(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        """
+        Interns a new station name and returns its id.
+        """
+        station = len(self.names)
+        self.ids[name] = station
+        self.names.append(name)
+        # min starts at the highest and max at the lowest possible temperature
+        self.mins.append(MAX_TENTHS)
+        self.maxs.append(MIN_TENTHS)
+        self.sums.append(0)
+        self.counts.append(0)
+        return station
+
+    def update(self, station, m_min, m_max, m_sum, m_count):
+        """
+        Folds a partial [min, max, sum, count] aggregation into a station.
+        """
+        if m_min < self.mins[station]:
+            self.mins[station] = m_min
+        if m_max > self.maxs[station]:
+            self.maxs[station] = m_max
+        self.sums[station] += m_sum
+        self.counts[station] += m_count
+
+    def merge(self, other):
+        """
+        Merges another table into this one, see `merge_columns`.
+        """
+        self.merge_columns(other.names, other.preloaded, other.mins, other.maxs, other.sums, other.counts)
+
+    def merge_columns(self, names, preloaded, mins, maxs, sums, counts):
+        """
+        Merges another table, given as its names and aggregation columns, into this one.
+
+        Ids preloaded in both tables are reduced element-wise; names the other table
+        discovered on its own are looked up (and interned if new) by name.
+        """
+        shared = min(self.preloaded, preloaded)
+        own_mins, own_maxs, own_sums, own_counts = self.mins, self.maxs, self.sums, self.counts
+        for station in range(shared):
+            if counts[station]:
+                if mins[station] < own_mins[station]:
+                    own_mins[station] = mins[station]
+                if maxs[station] > own_maxs[station]:
+                    own_maxs[station] = maxs[station]
+                own_sums[station] += sums[station]
+                own_counts[station] += counts[station]
+
+        ids = self.ids
+        for station in range(shared, len(counts)):
+            if counts[station]:
+                name = names[station]
+                own = ids.get(name)
+                if own is None:
+                    own = self.add(name)
+                self.update(own, mins[station], maxs[station], sums[station], counts[station])
+
+    def items(self):
+        """
+        Yields (name, (min, max, sum, count)) for every station that has measurements.
+        """
+        for station, name in enumerate(self.names):
+            if self.counts[station]:
+                yield name, (self.mins[station], self.maxs[station], self.sums[station], self.counts[station])
+
+    def __getstate__(self):
+        return {
+            "names": self.names,
+            "preloaded": self.preloaded,
+            "mins": array("q", self.mins),
+            "maxs": array("q", self.maxs),
+            "sums": array("q", self.sums),
+            "counts": array("q", self.counts),
+        }
+
+    def __setstate__(self, state):
+        self.names = state["names"]
+        self.preloaded = state["preloaded"]
+        self.ids = {name: station for station, name in enumerate(self.names)}
+        self.mins = state["mins"].tolist()
+        self.maxs = state["maxs"].tolist()
+        self.sums = state["sums"].tolist()
+        self.counts = state["counts"].tolist()
+
+
+class RowFilter:
+    """
+    Station-name and temperature predicates pushed down into the window scanners.
+
+    `stations` are exact names, `prefixes` name prefixes (a name passes if it matches
+    either); `min_tenths`/`max_tenths` bound the temperature, inclusive. Prefixes are
+    grouped by length, so testing a name costs one slice and set lookup per distinct
+    prefix length. Scanners only test a name the first time they see it.
+    """
+
+    def __init__(self, stations=None, prefixes=None, min_tenths=None, max_tenths=None):
+        self.stations = set(stations) if stations is not None else None
+        self.prefixes = None
+        if prefixes is not None:
+            self.prefixes = {}
+            for prefix in prefixes:
+                self.prefixes.setdefault(len(prefix), set()).add(prefix)
+        self.min_tenths = MIN_TENTHS if min_tenths is None else min_tenths
+        self.max_tenths = MAX_TENTHS if max_tenths is None else max_tenths
+        self.filters_names = stations is not None or prefixes is not None
+        self.filters_temperatures = self.min_tenths > MIN_TENTHS or self.max_tenths < MAX_TENTHS
+        self._tenths = None
+        # Name -> whether it passes, filled in by the scanners as they meet names
+        self.decided = {}
+
+    def accepts_name(self, name):
+        if not self.filters_names:
+            return True
+        if self.stations is not None and name in self.stations:
+            return True
+        if self.prefixes is not None:
+            for length, prefixes in self.prefixes.items():
+                if name[:length] in prefixes:
+                    return True
+        return False
+
+    def accepts_tenths(self, value):
+        return self.min_tenths <= value <= self.max_tenths
+
+    def restrict(self, tenths):
+        """
+        Returns the entries of a text -> tenths table that lie in the temperature
+        range, so parsing and range checking are one lookup. Computed once.
+        """
+        if self._tenths is None:
+            self._tenths = {text: value for text, value in tenths.items() if self.accepts_tenths(value)}
+        return self._tenths
@@ -1,36 +1,28 @@
 import os
+import mmap
 import argparse
 import multiprocessing as mp
 import time
 import sys
 
+from _chunker import split_range
+from _output import write_results
+
 
 def make_chunks(file_name: str):
     """Split file into chunks based on lines to prepare parallel processing."""
     cpu_count = mp.cpu_count()
     file_size = os.path.getsize(file_name)
-    chunk_size = file_size // cpu_count
-
-    chunks = []
-    with open(file_name, mode="rb") as f:
-        start = 0
-
-        for _ in range(cpu_count):
-            f.seek(start + chunk_size)
-            f.readline()  # move to end of this line
+    chunk_size = max(1, file_size // cpu_count)
+    if file_size == 0:
+        return cpu_count, []  # an empty file cannot be mapped
 
-            end = f.tell()
-
-            # If end exceeds file size, this is the last chunk
-            if end >= file_size:
-                end = file_size
-
-            chunks.append((file_name, start, end))
-            start = end
-
-            if end == file_size:
-                break  # last chunk reached, end loop
+    # Boundaries are found with a bulk newline search over a read-only mapping
+    with open(file_name, mode="rb") as f, mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ) as mm:
+        boundaries = split_range(mm, 0, file_size, chunk_size)
 
+    # Each chunk ends just past the newline of its last line
+    chunks = [(file_name, start, min(end + 1, file_size)) for start, end in boundaries]
     return cpu_count, chunks
 
 
@@ -44,7 +36,7 @@ def _process_file_chunk(file_name: str, chunk_start: int, chunk_end: int):
                 break
             try:
                 city, measurement = line.strip().split(b";")
-                measurement = float(measurement) * 10
+                measurement = int(measurement.replace(b".", b""))  # exact integer tenths
             except Exception:
                 continue
 
@@ -76,13 +68,7 @@ def process_file(cpu_count, start_end_chunks):
             else:
                 result[city] = values
 
-    def format_val(val):
-        return f"{val / 10:.1f}"
-
-    for city in sorted(result):
-        min_val, max_val, total, count = result[city]
-        mean_val = total / count
-        print(f"{city.decode('utf-8')}={format_val(min_val)}/{format_val(mean_val)}/{format_val(max_val)}")
+    write_results(result.items())
 
 
 if __name__ == "__main__":
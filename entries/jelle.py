@@ -1,160 +1,781 @@
+import glob
 import os
-import mmap
+import sys
+import time
 import multiprocessing as mp
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import _chunker
+import _scan
+from _checkpoint import load_checkpoint, save_checkpoint
+from _histogram import QUANTILES, HistogramTable, parse_quantiles
+from _io_policy import POLICIES, IoPolicy
+from _output import FORMATS, ORDERS, write_results
+from _pread import READ_BUFFER, PreadReader, nominal_chunks
+from _scan import CHUNK_SIZE, ENGINES, WINDOW_SIZE, load_engine, open_mapping, phase_times
+from _shared import LocalResults, SharedResults
+from _stations import StationTable, load_station_names
 
 # Global mmap object. Each process (due to fork) can directly access this.
 mm = None
 
+# How the workers read the file: through one shared mapping, or with their own
+# double-buffered preads (see _pread.py).
+READERS = ("mmap", "pread")
+
+# How worker processes are started, see `process_file_from_path`. Fork, where the
+# platform has it, shares the parent's mapping for free.
+START_METHODS = tuple(mp.get_all_start_methods())
+DEFAULT_START_METHOD = "fork" if "fork" in START_METHODS else "spawn"
+
+
+def gil_enabled():
+    """
+    Whether this interpreter runs Python code under the GIL, i.e. whether worker
+    threads would take turns instead of parsing in parallel. Only free-threaded
+    builds (3.13t and later) can turn it off.
+    """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is None or is_gil_enabled()
+
 
-def make_chunks(file_name: str):
+def make_chunks(file_name: str, chunk_size: int = CHUNK_SIZE, lazy: bool = False):
     """
     Memory-maps the entire input file and splits it into chunks based on line boundaries.
 
     Each chunk is defined by (start_byte, end_byte) to allow multiple processes to work
     on disjoint slices of the file in parallel without overlap or missing lines.
+    The file is cut into many chunks of roughly `chunk_size` bytes, which are handed
+    out to the workers on demand (see `worker`). With `lazy`, no boundary is searched
+    up front: each chunk is aligned by the worker that claims it (see _chunker.py).
 
     Returns:
-        List of (start, end) byte offsets for each process to work on.
+        Sequence of (start, end) byte offsets, in file order.
+    """
+    size = map_file(file_name)
+    if lazy:
+        return _chunker.LazyChunks(mm, 0, size, chunk_size)
+    return _chunker.split_range(mm, 0, size, chunk_size)
+
+
+def map_file(file_name: str):
+    """
+    Memory-maps the entire input file in read-only mode into the global `mm`.
+    Pages are only read in when touched, so mapping a large file is cheap.
+
+    Returns:
+        The file size in bytes.
     """
     global mm
-    cpu_count = mp.cpu_count()
-    size = os.path.getsize(file_name)
-    chunk_size = size // cpu_count
-
-    # Memory-map the entire file in read-only mode.
-    with open(file_name, 'rb') as f:
-        mm = mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
-
-    chunks = []
-    start = 0
-    for _ in range(cpu_count):
-        end = start + chunk_size
-        # Adjust 'end' to the next newline to avoid splitting a line
-        if end >= size:
-            end = size
-        else:
-            while end < size and mm[end:end + 1] != b'\n':
-                end += 1
-        chunks.append((start, end))
-        start = end + 1
-        if start >= size:
-            break
-    return chunks
+    mm = open_mapping(file_name)
+    return len(mm)
 
 
-def agg_initializer():
+def process_chunk(start, end, table, window_size=WINDOW_SIZE, window_processor=None, io_policy=None):
     """
-    Returns the initial aggregation state for a city:
-    [min, max, sum, count]
+    Processes a single chunk of the global `mm`, see `_scan.process_chunk`.
     """
-    return [float('inf'), float('-inf'), 0.0, 0]
+    _scan.process_chunk(mm, start, end, table, window_size, window_processor, io_policy)
 
 
-def process_chunk(start, end, queue):
+def appended_chunks(file_name: str, chunk_size: int = CHUNK_SIZE):
     """
-    Processes a single chunk of the mmap (from start to end byte offset).
+    Memory-maps the input file and splits only the lines appended since its last
+    checkpoint into chunks (see _checkpoint.py).
 
-    Builds a defaultdict of aggregations:
-    - min temperature
-    - max temperature
-    - sum of temperatures
-    - count of measurements
+    A last line without a trailing newline may still be being written, so it is left
+    for the next run.
 
-    Finally puts the resulting dictionary on the multiprocessing queue
-    for the parent process to collect.
+    Returns:
+        (chunks, checkpoint, offset) where `checkpoint` is what `load_checkpoint`
+        returned (None to start from scratch) and `offset` is where the next run resumes.
+    """
+    size = map_file(file_name)
+    checkpoint = load_checkpoint(file_name, mm)
+    start = checkpoint[0] if checkpoint else 0
+    newline = mm.rfind(b'\n', start, size)
+    if newline == -1:
+        return [], checkpoint, start
+    return _chunker.split_range(mm, start, newline, chunk_size), checkpoint, newline + 1
 
-    This function runs in its own process.
+
+def worker(
+    worker_id,
+    chunks,
+    counter,
+    results,
+    t_start,
+    chunk_processor=process_chunk,
+    station_names=(),
+    profile_dir=None,
+    initializer=None,
+):
     """
-    result = defaultdict(agg_initializer)
-    data = mm[start:end]
+    Work-stealing loop of a single worker process.
 
-    # Split data into lines
-    for line in data.splitlines():
-        city, measurement = line.split(b";")
-        measurement = float(measurement) * 10  # multiply by 10 trick for integers
+    Repeatedly claims the next unprocessed chunk index from the shared `counter`
+    and aggregates that chunk into one StationTable (a HistogramTable if `results`
+    has room for histograms) with `chunk_processor(start, end, table)`, until all
+    chunks are taken. The table starts from the preloaded `station_names`, so those
+    ids are the same in every worker. Finally writes the table, together with timing stats for this
+    worker, into this worker's slot of the shared memory `results`. With a
+    `profile_dir`, the worker runs under cProfile and dumps its profile there.
 
-        # Retrieve the aggregation list for this city
-        agg = result[city]
-        m_min, m_max, m_sum, m_count = agg
-        # Update the aggregation values
-        if measurement < m_min:
-            agg[0] = measurement
-        if measurement > m_max:
-            agg[1] = measurement
-        agg[2] = m_sum + measurement
-        agg[3] = m_count + 1
+    An `initializer` is called once before the first chunk. Workers that were not
+    forked use it to map the file themselves (e.g. `partial(map_file, path)`), so they
+    only ever receive paths and offsets and map the file once for all their chunks.
 
-    # Convert defaultdict to regular dict
-    queue.put(dict(result))
+    This function runs in its own process, or in a thread of the parent with
+    `aggregate_chunks(..., threads=True)`.
+    """
+    if initializer is not None:
+        initializer()
+        if isinstance(chunks, _chunker.LazyChunks):
+            chunks.mapping = mm
+    profiler = None
+    if profile_dir is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
 
+    table = (HistogramTable if results.histograms else StationTable)(station_names)
+    stats = {
+        "worker": worker_id,
+        "chunks": 0,
+        "bytes": 0,
+        "busy": 0.0,
+        "slowest_chunk": 0.0,
+        "started": time.time() - t_start,
+    }
+    n_chunks = len(chunks)
 
-def merge_results(chunk_results):
+    while True:
+        with counter.get_lock():
+            index = counter.value
+            counter.value += 1
+        if index >= n_chunks:
+            break
+
+        t0 = time.perf_counter()
+        start, end = chunks[index]
+        chunk_processor(start, end, table)
+        elapsed = time.perf_counter() - t0
+
+        stats["chunks"] += 1
+        stats["bytes"] += end - start
+        stats["busy"] += elapsed
+        if elapsed > stats["slowest_chunk"]:
+            stats["slowest_chunk"] = elapsed
+
+    stats["finished"] = time.time() - t_start
+    stats["rows"] = sum(table.counts)
+    if phase_times:
+        stats["phases"] = phase_times
+
+    if profiler is not None:
+        from _instrument import profile_path
+        profiler.disable()
+        profiler.dump_stats(profile_path(profile_dir, worker_id))
+
+    results.write(worker_id, table, stats)
+
+
+def merge_results(results, station_names=()):
     """
-    Merges multiple partial aggregation dictionaries into a final one.
+    Merges the partial StationTables of all workers into a final one.
+
+    Each worker's slot is reduced in place from shared memory, preloaded ids
+    element-wise, see `SharedResults.merge_into`. Returns the final table and the
+    stats of every worker.
 
     This runs in the main process after all workers have completed.
     """
-    result = defaultdict(agg_initializer)
-    for chunk_result in chunk_results:
-        for city, values in chunk_result.items():
-            agg = result[city]
-            if values[0] < agg[0]:
-                agg[0] = values[0]
-            if values[1] > agg[1]:
-                agg[1] = values[1]
-            agg[2] += values[2]
-            agg[3] += values[3]
-    return result
+    result = (HistogramTable if results.histograms else StationTable)(station_names)
+    worker_stats = [results.merge_into(worker_id, result) for worker_id in range(results.workers)]
+    return result, worker_stats
+
+
+def print_worker_stats(worker_stats):
+    """
+    Prints per-worker timing stats to stderr, ordered by finishing time.
+
+    The spread between the first and the last worker to finish is the time
+    cores sat idle at the tail of the run.
+    """
+    worker_stats = sorted(worker_stats, key=lambda s: s["finished"])
+    print("\nworker  chunks   busy(s)  slowest(s)  finished(s)", file=sys.stderr)
+    for s in worker_stats:
+        print(
+            f"{s['worker']:>6}  {s['chunks']:>6}  {s['busy']:>8.2f}  {s['slowest_chunk']:>10.3f}  {s['finished']:>11.2f}",
+            file=sys.stderr,
+        )
+    tail = worker_stats[-1]["finished"] - worker_stats[0]["finished"]
+    print(f"tail: last worker finished {tail:.2f} seconds after the first", file=sys.stderr)
+
+
+def aggregate_chunks(
+    chunks,
+    chunk_processor=process_chunk,
+    workers=None,
+    station_names=(),
+    t_start=None,
+    profile_dir=None,
+    phases=None,
+    histograms=False,
+    threads=False,
+    initializer=None,
+):
+    """
+    Aggregates the given chunks on a fixed pool of worker processes that pull chunks
+    from a shared counter, and merges the results they leave in shared memory.
+    The time spent in the workers and in the merge is recorded in `phases`, if given.
+    With `histograms`, the tables are HistogramTables, for a `chunk_processor` that
+    fills their buckets.
+
+    With `threads`, the workers are threads of this process instead, over the same
+    mapping, and their tables are merged directly (see `LocalResults`). That only
+    runs in parallel where the GIL is disabled, see `gil_enabled`.
+
+    Worker processes are started with the current start method. Unless that is fork,
+    pass an `initializer` that maps the input in each worker, see `worker`.
+
+    Returns:
+        (table, worker_stats), see `merge_results`.
+    """
+    if not chunks:
+        return (HistogramTable if histograms else StationTable)(station_names), []
+    t_start = time.time() if t_start is None else t_start
+    workers = min(workers or mp.cpu_count(), len(chunks))
+    counter = mp.Value('l', 0)
+    results = LocalResults(workers, histograms) if threads else SharedResults(workers, station_names, histograms)
+
+    phases = {} if phases is None else phases
 
+    try:
+        t0 = time.perf_counter()
+        args = [
+            (worker_id, chunks, counter, results, t_start, chunk_processor, station_names, profile_dir, initializer)
+            for worker_id in range(workers)
+        ]
+        if threads:
+            with ThreadPoolExecutor(workers, thread_name_prefix="worker") as pool:
+                futures = [pool.submit(worker, *worker_args) for worker_args in args]
+            failed = [worker_id for worker_id, future in enumerate(futures) if future.exception() is not None]
+            if failed:
+                raise RuntimeError(f"worker(s) {failed} failed") from futures[failed[0]].exception()
+        else:
+            processes = []
+            for worker_args in args:
+                p = mp.Process(target=worker, args=worker_args)
+                p.start()
+                processes.append(p)
+
+            # Ensure processes have completed; nothing is left in a pipe to drain first
+            for p in processes:
+                p.join()
+            failed = [worker_id for worker_id, p in enumerate(processes) if p.exitcode != 0]
+            if failed:
+                raise RuntimeError(f"worker(s) {failed} failed")
+        t1 = time.perf_counter()
+
+        # Merge all partial results
+        merged = merge_results(results, station_names)
+        phases["workers"] = t1 - t0
+        phases["merge"] = time.perf_counter() - t1
+        return merged
+    finally:
+        results.unlink()
 
-def process_file_from_path(filename):
+
+def process_file_from_path(
+    filename,
+    workers=None,
+    chunk_size=CHUNK_SIZE,
+    window_size=WINDOW_SIZE,
+    engine="python",
+    stations_file=None,
+    stats=False,
+    incremental=False,
+    use_cache=True,
+    row_filter=None,
+    instrument=False,
+    report_file=None,
+    profile_dir=None,
+    n_chunks=None,
+    lazy_chunks=False,
+    output_format="lines",
+    order="bytes",
+    histogram=False,
+    quantiles=QUANTILES,
+    threads=False,
+    start_method=DEFAULT_START_METHOD,
+    io_policy="default",
+    hugepages=False,
+    reader="mmap",
+    read_buffer=READ_BUFFER,
+):
     """
     Main entry point to process a file given by path.
-    - Sets up mmap and chunks
-    - Spawns processes to handle each chunk
-    - Gathers results from processes
-    - Merges results and prints final output
+    - Preloads station ids from `stations_file`, if given
+    - Sets up mmap and chunks; with `incremental`, only for the lines appended since
+      the checkpoint next to the file. Otherwise, with `use_cache` and an up-to-date
+      binary cache next to the file (see _cache.py), chunks are row ranges of the cache
+    - Spawns a fixed pool of worker processes that pull chunks from a shared counter
+    - Merges the results the processes left in shared memory (and the checkpointed
+      state) and prints final output
+    - With `incremental`, saves the merged state as the new checkpoint
+
+    With a `row_filter` (see `_stations.RowFilter`), only the rows that pass it are
+    aggregated. It cannot be combined with `incremental`, whose checkpoint must hold
+    every row.
+
+    `n_chunks` overrides `chunk_size` by cutting the file into that many chunks, and
+    `lazy_chunks` leaves aligning them to the workers (see `make_chunks`).
+
+    The results are written in `output_format`, with stations sorted by `order`, see
+    _output.py.
+
+    With `histogram`, every station's measurements are also counted per temperature,
+    and the `quantiles` (in percent), variance and standard deviation are reported,
+    see _histogram.py. This always parses the text with the python engine, and
+    cannot be combined with a `row_filter` or `incremental`.
+
+    With `instrument`, a per-phase timing report is printed to stderr (and written as
+    JSON to `report_file`, if given); with `profile_dir`, every worker is profiled
+    with cProfile and the merged profile is printed, see _instrument.py.
+
+    With `threads`, the workers are threads of this process if the GIL is disabled
+    (see `gil_enabled`); otherwise this says so on stderr and forks processes as
+    usual. The per-phase timings of `instrument` are per process, so they cannot be
+    combined with threads.
+
+    Worker processes are started with `start_method`. With fork (the default where
+    available) they inherit the parent's mapping. With spawn or forkserver every
+    worker maps the file (or the cache) itself when it starts, see `worker`. The
+    per-phase timings of `instrument` rely on fork.
+
+    `io_policy` and `hugepages` choose the kernel advice given while the text is
+    scanned, see _io_policy.py.
+
+    With `reader="pread"`, the file is not mapped. Each worker reads its chunks with
+    `os.preadv` into two buffers of `read_buffer` bytes, one filled in the background
+    while the other is parsed, see _pread.py. The binary cache is not used then, and
+    neither `incremental` nor an `io_policy` apply.
     """
-    mp.set_start_method('fork', force=True)  # boosts Mac/Linux for mmap sharing
-    chunks = make_chunks(filename)
-    queue = mp.Queue()
+    if incremental and row_filter is not None:
+        raise ValueError("a row filter cannot be combined with incremental mode")
+    if histogram and incremental:
+        raise ValueError("histograms cannot be combined with incremental mode")
+    if reader == "pread" and (incremental or io_policy != "default" or hugepages):
+        raise ValueError("the pread reader cannot be combined with incremental mode or an I/O policy")
+    t_start = time.time()
+    mp.set_start_method(start_method, force=True)
+    instrument = instrument or report_file is not None
+    if threads and instrument:
+        raise ValueError("per-phase timings cannot be combined with worker threads")
+    if threads and gil_enabled():
+        print("the GIL is enabled, using worker processes instead of threads", file=sys.stderr)
+        threads = False
+    if instrument and start_method != "fork" and not threads:
+        raise ValueError("per-phase timings need the fork start method")
+    # Forked workers and threads share this process's mapping
+    reopen = start_method != "fork" and not threads
+    phases = {}
+    window_processor = load_engine(engine, row_filter=row_filter, instrument=instrument, histogram=histogram)
+    station_names = load_station_names(stations_file) if stations_file else ()
+    advice = None
+    if io_policy != "default" or hugepages:
+        advice = IoPolicy(filename, io_policy, hugepages)
+    chunk_processor = partial(
+        process_chunk, window_size=window_size, window_processor=window_processor, io_policy=advice
+    )
+    cache = None
+    initializer = partial(map_file, filename) if reopen else None
+    if incremental:
+        chunks, checkpoint, offset = appended_chunks(filename, chunk_size)
+    else:
+        if use_cache and not histogram and reader == "mmap":
+            import _cache
 
-    processes = []
-    for start, end in chunks:
-        p = mp.Process(target=process_chunk, args=(start, end, queue))
-        p.start()
-        processes.append(p)
+            cache = _cache.open_cache(filename)
+        if cache is not None:
+            _cache.columns = cache
+            chunks = cache.row_chunks(max(1, chunk_size // _cache.ROW_BYTES))
+            column_processor = load_engine(engine, columns=True, row_filter=row_filter, instrument=instrument)
+            chunk_processor = partial(_cache.process_rows, column_processor=column_processor)
+            initializer = partial(_cache.reopen_cache, filename) if reopen else None
+            # Cache ids double as table ids; other preloaded names are not needed
+            station_names = cache.names
+        else:
+            t0 = time.perf_counter()
+            size = os.path.getsize(filename) if reader == "pread" else map_file(filename)
+            t1 = time.perf_counter()
+            if n_chunks:
+                chunk_size = max(1, -(-size // n_chunks))
+            if reader == "pread":
+                # Every worker aligns the chunks it claims while reading them
+                chunks = nominal_chunks(size, chunk_size)
+                chunk_processor = partial(
+                    PreadReader(filename, read_buffer).process_chunk,
+                    window_size=window_size,
+                    window_processor=window_processor,
+                )
+                initializer = None
+            elif lazy_chunks:
+                chunks = _chunker.LazyChunks(mm, 0, size, chunk_size)
+            else:
+                chunks = _chunker.split_range(mm, 0, size, chunk_size)
+            phases["map"] = t1 - t0
+            phases["chunking"] = time.perf_counter() - t1
 
-    # Collect results
-    chunk_results = []
-    for _ in processes:
-        chunk_results.append(queue.get())
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+    final_result, worker_stats = aggregate_chunks(
+        chunks, chunk_processor, workers, station_names, t_start, profile_dir, phases, histogram, threads, initializer
+    )
 
-    # Ensure processes have completed
-    for p in processes:
-        p.join()
+    if incremental:
+        if checkpoint:
+            _, names, columns = checkpoint
+            final_result.merge_columns(names, 0, *columns)
+        save_checkpoint(filename, mm, offset, final_result)
 
-    # Merge all partial results
-    final_result = merge_results(chunk_results)
+    # Write sorted results
+    t0 = time.perf_counter()
+    items = final_result.summary_items(quantiles) if histogram else final_result.items()
+    write_results(items, output_format, order)
+    phases["output"] = time.perf_counter() - t0
 
-    # Print sorted results
-    for city in sorted(final_result):
-        min_val, max_val, total, count = final_result[city]
-        mean_val = total / count
-        print(f"{city.decode()}={min_val / 10:.1f}/{mean_val / 10:.1f}/{max_val / 10:.1f}")
+    if stats and worker_stats:
+        print_worker_stats(worker_stats)
+    if instrument:
+        from _instrument import build_report, print_report, write_report
+
+        if cache is not None:
+            # Cache chunks are row ranges
+            for s in worker_stats:
+                s["bytes"] *= _cache.ROW_BYTES
+        report = build_report(phases, worker_stats, time.time() - t_start)
+        print_report(report)
+        if report_file is not None:
+            write_report(report, report_file)
+    if profile_dir is not None:
+        from _instrument import merge_profiles
+
+        merge_profiles(profile_dir)
 
 
 if __name__ == "__main__":
     import argparse
-    import time
-    import sys
 
     parser = argparse.ArgumentParser(description="Process billion row temperatures with mmap, multiprocessing and aggregation.")
-    parser.add_argument("filename", type=str, help="measurements.txt file")
+    parser.add_argument("filename", type=str, nargs="*", help="measurements.txt file; several files, directories or quoted glob patterns are aggregated together on one pool")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: CPU count)")
+    parser.add_argument("--start-method", choices=START_METHODS, default=DEFAULT_START_METHOD, help=f"how worker processes are started (default: {DEFAULT_START_METHOD}); spawn and forkserver workers map the file themselves")
+    parser.add_argument("--reader", choices=READERS, default="mmap", help="read the file through one shared mmap (default), or with double-buffered preads in every worker")
+    parser.add_argument("--read-buffer", type=int, default=READ_BUFFER // (1024 * 1024), help="size in MiB of each of the two buffers of --reader pread")
+    parser.add_argument("--io-policy", choices=POLICIES, default="default", help="kernel advice while scanning: none (default), sequential readahead, or readahead plus dropping parsed windows from memory and the page cache")
+    parser.add_argument("--hugepages", action="store_true", help="also ask for transparent huge pages on the mapping, where the kernel supports them for files")
+    parser.add_argument("--threads", action="store_true", help="run the workers as threads over one mapping if the GIL is disabled (free-threaded builds), else fall back to processes")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE // (1024 * 1024), help="chunk size in MiB handed out to workers")
+    parser.add_argument("--chunks", type=int, default=None, help="cut the file into this many chunks instead (overrides --chunk-size)")
+    parser.add_argument("--lazy-chunks", action="store_true", help="let each worker align the chunk it claims instead of aligning all chunks up front")
+    parser.add_argument("--window-size", type=int, default=WINDOW_SIZE // 1024, help="window size in KiB a worker copies out of the mmap at a time")
+    parser.add_argument("--engine", choices=ENGINES, default=None, help="window processor (default: python); numpy requires NumPy")
+    parser.add_argument("--preload-stations", metavar="CSV", default=None, help="intern station names from e.g. weather_stations.csv up front, so all workers share ids")
+    parser.add_argument("--stats", action="store_true", help="print per-worker timing stats to stderr")
+    parser.add_argument("--incremental", action="store_true", help="only process lines appended since the last --incremental run, resuming from FILE.ckpt")
+    parser.add_argument("--build-cache", action="store_true", help="parse the file once into a binary FILE.cache, which later runs use while the file is unchanged")
+    parser.add_argument("--no-cache", action="store_true", help="parse the text even if an up-to-date FILE.cache exists")
+    parser.add_argument("--build-index", action="store_true", help="(re)build the block summary index FILE.idx and answer from it")
+    parser.add_argument("--block-size", type=int, default=64, help="block size in MiB of the index (with --build-index)")
+    parser.add_argument("--rows", metavar="START:END", help="only aggregate this row range, answered from FILE.idx (e.g. --rows=-1000000: for the last million rows)")
+    parser.add_argument("--stations", action="append", metavar="NAME,...", help="only aggregate these stations (repeatable); answered from FILE.idx if there is one")
+    parser.add_argument("--prefixes", action="append", metavar="PREFIX,...", help="only aggregate stations whose name starts with one of these (repeatable)")
+    parser.add_argument("--min-temp", type=str, default=None, help="only aggregate measurements of at least this temperature")
+    parser.add_argument("--max-temp", type=str, default=None, help="only aggregate measurements of at most this temperature")
+    parser.add_argument("--format", choices=FORMATS, default="lines", help="output format: one station per line (default), the challenge's {A=x/y/z, ...}, CSV or JSON Lines")
+    parser.add_argument("--sort", choices=ORDERS, default="bytes", help="sort stations by UTF-8 bytes (default) or by the collation of the current locale")
+    parser.add_argument("--histogram", action="store_true", help="also report quantiles, variance and standard deviation per station from exact histograms")
+    parser.add_argument("--quantiles", metavar="P,...", default=None, help="quantiles in percent reported with --histogram (default: 50,95,99)")
+    parser.add_argument("--instrument", action="store_true", help="print per-phase timings and throughput of every worker to stderr")
+    parser.add_argument("--instrument-json", metavar="PATH", help="also write the --instrument report as JSON (implies --instrument)")
+    parser.add_argument("--cprofile", metavar="DIR", help="run every worker under cProfile, dump DIR/worker-N.prof and print the merged profile")
+    parser.add_argument("--serve", metavar="ADDRESS", help="run a persistent worker-pool server on HOST:PORT or a Unix socket path")
+    parser.add_argument("--root", dest="roots", action="append", metavar="DIR", help="only answer requests for files under this directory (with --serve, repeatable; default: the current directory)")
+    parser.add_argument("--max-open", type=int, default=8, help="files each process keeps mapped (with --serve or several inputs)")
+    parser.add_argument("--per-file", metavar="DIR", help="with several inputs, also write each file's results under DIR")
+    parser.add_argument("--connect", metavar="ADDRESS", help="send the request to a server started with --serve")
+    parser.add_argument("--range", dest="ranges", action="append", metavar="START:END", help="only aggregate lines starting in this byte range (with --connect, repeatable)")
+    parser.add_argument("--agent", dest="agents", action="append", metavar="ADDRESS[=PATH]", help="aggregate on servers started with --serve, possibly on other hosts (repeatable): FILE in byte ranges, or PATH on that agent's host")
+    parser.add_argument("--range-size", type=int, default=64, help="size in MiB of the byte ranges of FILE handed to agents (with --agent)")
+    parser.add_argument("--retries", type=int, default=3, help="times a failed range is retried before giving up (with --agent)")
+    parser.add_argument("--agent-timeout", type=float, default=600, help="seconds an agent may take to answer one range (with --agent)")
     args = parser.parse_args()
 
+    if args.serve:
+        from _server import serve
+
+        serve(
+            args.serve,
+            workers=args.workers,
+            chunk_size=args.chunk_size * 1024 * 1024,
+            window_size=args.window_size * 1024,
+            engine=args.engine or "python",
+            stations_file=args.preload_stations,
+            max_open=args.max_open,
+            root_dirs=args.roots,
+        )
+        sys.exit()
+    if args.roots:
+        parser.error("--root only applies to --serve")
+    if args.agents:
+        agent_options = {
+            "several input files": len(args.filename) > 1,
+            "--incremental": args.incremental,
+            "--build-cache": args.build_cache,
+            "--build-index": args.build_index,
+            "--rows": args.rows,
+            "filters": args.stations or args.prefixes or args.min_temp is not None or args.max_temp is not None,
+            "--histogram": args.histogram or args.quantiles is not None,
+            "--instrument": args.instrument or args.instrument_json or args.cprofile or args.stats,
+            "--connect": args.connect,
+            "--range": args.ranges,
+            # Agents parse with the workers and settings they were started with
+            "--workers": args.workers is not None,
+            "--chunks": args.chunks or args.lazy_chunks,
+            "--threads": args.threads,
+            "--start-method": args.start_method != DEFAULT_START_METHOD,
+            "--io-policy": args.io_policy != "default" or args.hugepages,
+            "--reader": args.reader != "mmap",
+            "--preload-stations": args.preload_stations,
+            "--per-file": args.per_file,
+            "--no-cache": args.no_cache,
+        }
+        unsupported = [option for option, value in agent_options.items() if value]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} cannot be combined with --agent")
+        from _distributed import process_distributed
+
+        t0 = time.time()
+        try:
+            process_distributed(
+                args.filename[0] if args.filename else None,
+                args.agents,
+                range_size=args.range_size * 1024 * 1024,
+                engine=args.engine,
+                retries=args.retries,
+                timeout=args.agent_timeout,
+                output_format=args.format,
+                order=args.sort,
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        except RuntimeError as e:
+            sys.exit(f"distributed run failed: {e}")
+        print(f"\nProcessing took {time.time() - t0:.2f} seconds", file=sys.stderr)
+        sys.exit()
+    if args.ranges and not args.connect:
+        parser.error("--range is only answered by a server, give --connect too")
+    if not args.filename:
+        parser.error("the filename is required unless --serve or --agent is given")
+    inputs = args.filename
+    for item in inputs:
+        if not os.path.exists(item) and not glob.has_magic(item):
+            parser.error(f"{item}: no such file")
+    # Several files, a directory or a pattern the shell did not expand
+    multi = len(inputs) > 1 or os.path.isdir(inputs[0]) or not os.path.exists(inputs[0])
+    if multi:
+        from _multi import expand_inputs
+
+        try:
+            expand_inputs(inputs)
+        except FileNotFoundError as e:
+            parser.error(str(e))
+    compressed = False
+    if not multi:
+        # Gzip magic; _compressed.py is only imported for such files
+        with open(inputs[0], "rb") as f:
+            compressed = f.read(2) == b"\x1f\x8b"
+    if multi or compressed:
+        single_file_options = {
+            "--incremental": args.incremental,
+            "--build-cache": args.build_cache,
+            "--build-index": args.build_index,
+            "--rows": args.rows,
+            "filters": args.stations or args.prefixes or args.min_temp is not None or args.max_temp is not None,
+            "--histogram": args.histogram or args.quantiles is not None,
+            "--instrument": args.instrument or args.instrument_json or args.cprofile or args.stats,
+            "--connect": args.connect,
+            "--chunks": args.chunks or args.lazy_chunks,
+            "--threads": args.threads,
+            "--start-method": args.start_method != DEFAULT_START_METHOD,
+            "--io-policy": args.io_policy != "default" or args.hugepages,
+            "--reader": args.reader != "mmap",
+        }
+        unsupported = [option for option, value in single_file_options.items() if value]
+        if unsupported:
+            input_kind = "several input files" if multi else "compressed input"
+            parser.error(f"{', '.join(unsupported)} cannot be combined with {input_kind}")
+    if args.per_file and not multi:
+        parser.error("--per-file needs several input files, a directory or a glob pattern")
+    args.filename = inputs[0]
+
+    row_filter = None
+    if args.stations or args.prefixes or args.min_temp is not None or args.max_temp is not None:
+        import math
+        from decimal import Decimal, InvalidOperation
+
+        from _stations import RowFilter
+
+        def names(values):
+            return [name.encode() for value in values for name in value.split(",")] if values else None
+
+        def tenths(option, text, bound):
+            # Measurements are whole tenths: round a bound inwards, exactly, from its text
+            try:
+                value = Decimal(text) * 10
+            except InvalidOperation:
+                value = None
+            if value is None or not value.is_finite():
+                parser.error(f"{option}: not a temperature: {text!r}")
+            return bound(value)
+
+        row_filter = RowFilter(
+            stations=names(args.stations),
+            prefixes=names(args.prefixes),
+            min_tenths=None if args.min_temp is None else tenths("--min-temp", args.min_temp, math.ceil),
+            max_tenths=None if args.max_temp is None else tenths("--max-temp", args.max_temp, math.floor),
+        )
+    if args.rows is not None:
+        from _index import parse_row_range
+
+        try:
+            parse_row_range(args.rows, 0)  # the row count is only known once the index is open
+        except ValueError as e:
+            parser.error(f"--rows: {e}")
+    use_index = args.build_index or args.rows
+    if row_filter is not None and not row_filter.filters_temperatures:
+        from _index import index_path
+
+        use_index = use_index or os.path.exists(index_path(args.filename))
+    if use_index and row_filter is not None and row_filter.filters_temperatures:
+        parser.error("--min-temp and --max-temp cannot be answered from the block index (--build-index, --rows)")
+    if args.incremental and row_filter is not None:
+        parser.error("--incremental aggregates every row and cannot be combined with filters")
+    quantiles = QUANTILES
+    if args.quantiles is not None:
+        args.histogram = True
+        try:
+            quantiles = parse_quantiles(args.quantiles)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.histogram and (args.incremental or use_index or args.connect or row_filter is not None):
+        parser.error("--histogram cannot be combined with --incremental, filters, the block index or --connect")
+    if args.histogram and args.engine not in (None, "python"):
+        parser.error("--histogram is only supported by the python engine")
+    if args.threads and (args.instrument or args.instrument_json or use_index or args.connect):
+        parser.error("--threads cannot be combined with --instrument, the block index or --connect")
+    if args.start_method != DEFAULT_START_METHOD and (use_index or args.connect):
+        parser.error("--start-method cannot be combined with the block index or --connect")
+    if (args.io_policy != "default" or args.hugepages) and (use_index or args.connect):
+        parser.error("--io-policy and --hugepages cannot be combined with the block index or --connect")
+    if args.reader == "pread" and (args.incremental or use_index or args.connect):
+        parser.error("--reader pread cannot be combined with --incremental, the block index or --connect")
+    if args.reader == "pread" and (args.io_policy != "default" or args.hugepages):
+        parser.error("--io-policy and --hugepages advise the mapping, which --reader pread does not use")
+    if args.start_method != "fork" and (args.instrument or args.instrument_json):
+        parser.error("--instrument needs the fork start method")
+
     t0 = time.time()
-    process_file_from_path(args.filename)
+    if multi:
+        from _multi import process_files
+
+        process_files(
+            inputs,
+            workers=args.workers,
+            chunk_size=args.chunk_size * 1024 * 1024,
+            window_size=args.window_size * 1024,
+            engine=args.engine or "python",
+            stations_file=args.preload_stations,
+            max_open=args.max_open,
+            per_file_dir=args.per_file,
+            output_format=args.format,
+            order=args.sort,
+        )
+    elif compressed:
+        from _compressed import process_compressed
+
+        process_compressed(
+            args.filename,
+            workers=args.workers,
+            chunk_size=args.chunk_size * 1024 * 1024,
+            window_size=args.window_size * 1024,
+            engine=args.engine or "python",
+            stations_file=args.preload_stations,
+            output_format=args.format,
+            order=args.sort,
+        )
+    elif args.connect:
+        from _server import request
+
+        try:
+            ranges = [[int(offset) for offset in r.split(":")] for r in args.ranges or ()]
+        except ValueError:
+            parser.error("--range takes START:END byte offsets")
+        if any(len(r) != 2 for r in ranges):
+            parser.error("--range takes START:END byte offsets")
+        try:
+            sys.stdout.write(request(args.connect, args.filename, ranges, args.engine, args.format, args.sort))
+        except (RuntimeError, OSError, ValueError) as e:
+            # OSError covers a refused or lost connection, ValueError a garbled response
+            sys.exit(f"request to {args.connect} failed: {e}")
+    elif use_index:
+        from _index import query_file
+
+        table = query_file(
+            args.filename,
+            rows=args.rows,
+            row_filter=row_filter,
+            block_size=args.block_size * 1024 * 1024,
+            workers=args.workers,
+            window_size=args.window_size * 1024,
+            engine=args.engine or "python",
+            rebuild=args.build_index,
+        )
+        write_results(table.items(), args.format, args.sort)
+    else:
+        if args.build_cache:
+            from _cache import build_cache
+
+            build_cache(args.filename, args.window_size * 1024)
+        process_file_from_path(
+            args.filename,
+            workers=args.workers,
+            chunk_size=args.chunk_size * 1024 * 1024,
+            window_size=args.window_size * 1024,
+            engine=args.engine or "python",
+            stations_file=args.preload_stations,
+            stats=args.stats,
+            incremental=args.incremental,
+            use_cache=not args.no_cache,
+            row_filter=row_filter,
+            instrument=args.instrument,
+            report_file=args.instrument_json,
+            profile_dir=args.cprofile,
+            n_chunks=args.chunks,
+            lazy_chunks=args.lazy_chunks,
+            output_format=args.format,
+            order=args.sort,
+            histogram=args.histogram,
+            quantiles=quantiles,
+            threads=args.threads,
+            start_method=args.start_method,
+            io_policy=args.io_policy,
+            hugepages=args.hugepages,
+            reader=args.reader,
+            read_buffer=args.read_buffer * 1024 * 1024,
+        )
     t1 = time.time()
     print(f"\nProcessing took {t1 - t0:.2f} seconds", file=sys.stderr)
@@ -1,5 +1,7 @@
+import importlib.util
 import itertools as it
 import pathlib
+import shlex
 import subprocess
 from collections import defaultdict
 from timeit import default_timer as timer
@@ -39,7 +41,11 @@ def make_ground_truth():
     return result
 
 
-entries = list(pathlib.Path("entries/").glob("*.py"))
+# Each entry is the command line (minus the measurements file) to verify. Modules
+# starting with an underscore are helpers of the entries, not entries themselves.
+entries = [[str(path)] for path in sorted(pathlib.Path("entries/").glob("*.py")) if not path.name.startswith("_")]
+if importlib.util.find_spec("numpy") is not None:
+    entries.append(["entries/jelle.py", "--engine", "numpy"])
 
 ground_truth_path = pathlib.Path(f"ground_truth_{measurements_file}")
 if ground_truth_path.exists():
@@ -53,7 +59,7 @@ else:
 
 print("The following entries will be verified")
 for entry in entries:
-    print(f" - {entry}")
+    print(f" - {shlex.join(entry)}")
 
 
 def compare(ground_truth, result):
@@ -64,12 +70,14 @@ def compare(ground_truth, result):
 
 times = defaultdict(list)
 for entry in entries:
-    print(f"========== {entry} ==========")
+    # The argv list goes to subprocess as is; the joined form only names the entry
+    entry_name = shlex.join(entry)
+    print(f"========== {entry_name} ==========")
     for i in range(3):
         try:
             tic = timer()
             res = subprocess.run(
-                ["python", entry, measurements_file],
+                ["python", *entry, measurements_file],
                 encoding="utf-8",
                 capture_output=True,
                 text=True,
@@ -77,7 +85,7 @@ for entry in entries:
             toc = timer()
             res.check_returncode()
         except Exception as e:
-            print(f"entry {entry} failed to run succesfully: {e}")
+            print(f"entry {entry_name} failed to run succesfully: {e}")
         else:
             print("comparing result to ground truth")
             resultlines = res.stdout.splitlines()
@@ -107,7 +115,7 @@ for entry in entries:
                         if idx < 10:
                             print(f"comparison error at line, {diff_entry}")
             if not incorrect:
-                times[entry].append(toc - tic)
+                times[entry_name].append(toc - tic)
 
 print()
 print(f"========== leaderboard ==========")
@@ -2,21 +2,28 @@
 
 set -e
 
+MEASUREMENTS=${1:-measurements_ten_million.txt}
+
 echo "========================"
-echo "Running cProfile on entries/prime.py"
+echo "Running cProfile on entries/jelle.py"
 echo "========================"
 
-python -m cProfile -s tottime entries/1_prime.py measurements_ten_million.txt > cprofile_report.txt
+# Every worker runs under cProfile; the per-worker profiles are merged into
+# profiles/merged.prof and the phase timings and top functions go to the report.
+python entries/jelle.py "$MEASUREMENTS" --instrument --cprofile profiles > /dev/null 2> cprofile_report.txt
 
 echo ""
-echo " cProfile complete, results saved in cprofile_report.txt"
+echo " cProfile complete, results saved in cprofile_report.txt and profiles/merged.prof"
 echo ""
 
 echo "========================"
 echo "Running timeit micro benchmarks"
 echo "========================"
 
-python test_components/profile_prime.py
+for benchmark in test_components/*.py; do
+    echo "--- $benchmark"
+    python "$benchmark"
+done
 
 echo ""
 echo " timeit micro tests complete"
@@ -25,4 +32,4 @@ echo ""
 echo "========================"
 echo "Finished!"
 echo ""
-echo "Open cprofile_report.txt."
+echo "Open cprofile_report.txt, or browse profiles/merged.prof with: python profiling/profile.py"
@@ -1,10 +1,10 @@
-import cProfile
 import pstats
+import sys
 
 if __name__ == "__main__":
-    filename = "measurements_ten_million.txt"
-    profile_file = "cprofile_report.txt"
-    cProfile.run(f'process_file_from_path("{filename}")', filename=profile_file)
+    # Written by `python entries/jelle.py FILE --cprofile profiles` (see profile.sh)
+    profile_file = sys.argv[1] if len(sys.argv) > 1 else "profiles/merged.prof"
+    sort_key = sys.argv[2] if len(sys.argv) > 2 else "tottime"
 
     p = pstats.Stats(profile_file)
-    p.strip_dirs().sort_stats("tottime").print_stats(20)
+    p.strip_dirs().sort_stats(sort_key).print_stats(20)
@@ -0,0 +1,74 @@
+"""
+Runs of jelle.py's coordinator (`--agent`) against local agents (`--serve`).
+"""
+import random
+import socket
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+JELLE = Path(__file__).resolve().parent.parent / "entries" / "jelle.py"
+
+
+def run_jelle(*args):
+    return subprocess.run([sys.executable, str(JELLE), *map(str, args)], capture_output=True, text=True, timeout=300)
+
+
+def closed_port():
+    """
+    Returns a localhost port that nothing listens on.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def measurements(tmp_path):
+    """
+    A file of about 6 MiB: two ranges of 3 MiB, so the live agent is still busy with
+    the first one while the dead one keeps failing the second.
+    """
+    rng = random.Random(42)
+    names = [f"Station{i}" for i in range(50)]
+    path = tmp_path / "measurements.txt"
+    path.write_text("".join(f"{rng.choice(names)};{rng.randint(-999, 999) / 10:.1f}\n" for _ in range(400_000)))
+    return path
+
+
+@pytest.fixture
+def agent(tmp_path):
+    """
+    The address of a running agent with one worker, which reads the files under
+    `tmp_path`.
+    """
+    address = f"127.0.0.1:{closed_port()}"
+    server = subprocess.Popen(
+        [sys.executable, str(JELLE), "--serve", address, "--workers", "1", "--root", str(tmp_path)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert server.stdout.readline().startswith("serving on")
+        yield address
+    finally:
+        server.terminate()
+        server.wait()
+
+
+@pytest.mark.parametrize("retries", [0, 1, 3])
+def test_dead_agent_does_not_fail_the_run(measurements, agent, retries):
+    dead = f"127.0.0.1:{closed_port()}"
+    expected = run_jelle(measurements, "--no-cache")
+    result = run_jelle(measurements, "--agent", agent, "--agent", dead, "--range-size", 3, "--retries", retries)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == expected.stdout
+
+
+def test_no_live_agent_fails_the_run(measurements):
+    dead = [f"127.0.0.1:{closed_port()}" for _ in range(2)]
+    result = run_jelle(measurements, "--agent", dead[0], "--agent", dead[1], "--range-size", 1, "--retries", 1)
+    assert result.returncode == 1
+    assert "distributed run failed" in result.stderr